@@ -3,10 +3,13 @@ import statevector
 import coherent
 import quantumsystem
 import expvalues
+import operators
 import initialconditions
+import ensemble
 import visualization
 import animation
-from io import load_cppqed, load_statevector, save_statevector, split_cppqed
+from io import load_cppqed, load_expvalues, load_many, load_statevector,\
+               load_statevectors, save_statevector, split_cppqed
 from initialconditions import gaussian
 from statevector import StateVector
 from quantumsystem import QuantumSystem, Particle, Mode
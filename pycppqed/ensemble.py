@@ -0,0 +1,232 @@
+"""
+This module provides classes for averaging over ensembles of trajectories.
+
+The relevant classes are:
+    * :class:`ExpectationValueAccumulator`
+    * :class:`DensityMatrixAccumulator`
+
+Both consume one trajectory after the other, so averaging over an ensemble
+needs only memory for one trajectory and the accumulated quantities. The
+function :func:`average_cppqed` does this for a list of C++QED output files.
+"""
+
+import numpy
+import expvalues
+import io
+import statevector
+
+def _check_time(time, othertime):
+    """
+    Raise a ValueError if two trajectories don't share their points of time.
+    """
+    if time is None or othertime is None:
+        return
+    if len(time) != len(othertime) or not numpy.allclose(time, othertime):
+        raise ValueError("Trajectories have different points of time.")
+
+
+class ExpectationValueAccumulator:
+    """
+    Running mean and variance of expectation values over an ensemble.
+
+    *Usage*
+        >>> acc = ExpectationValueAccumulator()
+        >>> for path in paths:
+        ...     evs, qs = load_cppqed(path)
+        ...     acc.add(evs)
+        >>> mean = acc.mean()
+        >>> std = acc.std()
+
+    Mean and variance are updated with Welford's algorithm which, unlike
+    summing up values and their squares, doesn't lose precision when the
+    variance is small compared to the mean.
+    """
+    def __init__(self):
+        self.count = 0
+        self.time = None
+        self.titles = None
+        self._mean = None
+        self._m2 = None
+
+    def add(self, evs):
+        """
+        Add the expectation values of one trajectory.
+
+        *Arguments*
+            * *evs*
+                An :class:`pycppqed.expvalues.ExpectationValueCollection`
+                (or a 2D array) with the same shape as all trajectories
+                added before.
+        """
+        x = numpy.asarray(evs, dtype=float)
+        if self.count == 0:
+            self.time = getattr(evs, "time", None)
+            self.titles = getattr(evs, "titles", None)
+            self._mean = numpy.zeros(x.shape)
+            self._m2 = numpy.zeros(x.shape)
+        elif x.shape != self._mean.shape:
+            raise ValueError("Expectation values have shape %s instead of %s."
+                             % (x.shape, self._mean.shape))
+        else:
+            _check_time(self.time, getattr(evs, "time", None))
+        self.count += 1
+        delta = x - self._mean
+        self._mean += delta/self.count
+        self._m2 += delta*(x - self._mean)
+
+    def _collection(self, data):
+        return expvalues.ExpectationValueCollection(data, self.time,
+                                                    self.titles, copy=False)
+
+    def mean(self):
+        """
+        Return the ensemble mean as ExpectationValueCollection.
+        """
+        if self.count == 0:
+            raise ValueError("No trajectories added yet.")
+        return self._collection(self._mean.copy())
+
+    def var(self, ddof=0):
+        """
+        Return the ensemble variance as ExpectationValueCollection.
+
+        *Arguments*
+            * *ddof* (optional)
+                The variance is divided by ``count - ddof``. (Default is 0)
+        """
+        if self.count <= ddof:
+            raise ValueError("Not enough trajectories added yet.")
+        return self._collection(self._m2/(self.count - ddof))
+
+    def std(self, ddof=0):
+        """
+        Return the ensemble standard deviation as ExpectationValueCollection.
+
+        See also: :meth:`var`
+        """
+        return self._collection(numpy.sqrt(self.var(ddof)))
+
+
+class DensityMatrixAccumulator:
+    """
+    Running ensemble density matrix of a subsystem.
+
+    *Usage*
+        >>> acc = DensityMatrixAccumulator(0)
+        >>> for path in paths:
+        ...     evs, qs = load_cppqed(path)
+        ...     acc.add(qs.statevector)
+        >>> rho = acc.density_matrix()
+
+    *Arguments*
+        * *indices*
+            An integer or a list of integers specifying the subsystems which
+            are traced out, as in :meth:`pycppqed.StateVector.reducesquare`.
+
+    The reduced density matrix of every state vector is calculated as in
+    :meth:`pycppqed.statevector.StateVector.reducesquare` and averaged for
+    every point of time. The state vectors are processed in chunks and the
+    results are not cached, so besides the trajectory only memory for the
+    accumulated density matrices and one chunk is needed.
+    """
+    def __init__(self, indices):
+        self.indices = indices
+        self.count = 0
+        self.time = None
+        self._mean = None
+
+    def add(self, svs):
+        """
+        Add the state vectors of one trajectory.
+
+        *Arguments*
+            * *svs*
+                A :class:`pycppqed.statevector.StateVectorTrajectory` with the
+                same points of time as all trajectories added before.
+                Trajectories without state vectors are skipped.
+        """
+        if not len(svs.statevectors):
+            return
+        if self.count == 0:
+            self.time = svs.time
+        else:
+            if len(svs.statevectors) != len(self._mean):
+                raise ValueError("Trajectory has %s state vectors instead "
+                                 "of %s." % (len(svs.statevectors),
+                                             len(self._mean)))
+            _check_time(self.time, svs.time)
+        self.count += 1
+        ndim = svs.ndim - 1
+        if isinstance(self.indices, int):
+            summed = [self.indices]
+        else:
+            summed = sorted(self.indices)
+        kept = [i for i in range(ndim) if i not in summed]
+        K = int(numpy.prod([svs.shape[i+1] for i in kept]))
+        stepbytes = max(svs[:1].size, K*K)*16
+        chunksize = max(1, statevector._EXPVALUE_CHUNKBYTES//stepbytes)
+        for chunk in statevector._chunks(svs, chunksize):
+            rho = statevector._squares(svs[chunk], kept, summed)
+            if self._mean is None:
+                self._mean = numpy.zeros((len(svs),)+rho.shape[1:],
+                                         dtype=complex)
+            mean = self._mean[chunk]
+            mean += (rho - mean)/self.count
+
+    def density_matrix(self):
+        """
+        Return the ensemble density matrices for all points of time.
+
+        *Returns*
+            * *rho*
+                An array with the shape ``(ntimes, d1, .., dn, d1, .., dn)``
+                where ``d1, .., dn`` are the dimensions of the subsystems
+                which are kept.
+        """
+        if self.count == 0:
+            raise ValueError("No trajectories added yet.")
+        return self._mean.copy()
+
+
+def average_cppqed(paths, indices=None, **kwargs):
+    """
+    Average over an ensemble of C++QED output files.
+
+    *Usage*
+        >>> evacc, rhoacc = average_cppqed(glob.glob("mcwf/*.dat"), 0)
+        >>> mean, std = evacc.mean(), evacc.std()
+
+    *Arguments*
+        * *paths*
+            A list of paths to C++QED output files.
+
+        * *indices* (optional)
+            If given, also the ensemble density matrix of the state vectors
+            is calculated, where the given subsystems are traced out.
+
+        * Any other argument is passed to :func:`pycppqed.io.load_cppqed`.
+
+    *Returns*
+        * *evacc*
+            An :class:`ExpectationValueAccumulator`.
+
+        * *rhoacc*
+            A :class:`DensityMatrixAccumulator` or None if no *indices* are
+            given.
+
+    Only one file is loaded at any time.
+    """
+    evacc = ExpectationValueAccumulator()
+    if indices is None:
+        rhoacc = None
+    else:
+        rhoacc = DensityMatrixAccumulator(indices)
+    for path in paths:
+        evs, qs = io.load_cppqed(path, **kwargs)
+        evacc.add(evs)
+        if rhoacc is not None:
+            if qs.statevector is None:
+                raise ValueError("No state vectors in '%s'." % path)
+            rhoacc.add(qs.statevector)
+        del evs, qs
+    return evacc, rhoacc
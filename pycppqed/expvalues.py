@@ -93,7 +93,9 @@ class ExpectationValueCollection(numpy.ndarray):
         * Any other argument that a numpy array can use for creation. E.g.
           ``copy = False`` can be used so that the
           ExpectationValueCollection shares the data storage with the given
-          numpy array.
+          numpy array and ``dtype = numpy.float32`` stores the expectation
+          values in single precision. With ``copy = False`` also the single
+          ExpectationValueTrajectories and the subsystems are views.
     """
     def __new__(cls, data, time=None, titles=None, subsystems=None, **kwargs):
         if isinstance(data, ExpectationValueTrajectory):
@@ -107,8 +109,13 @@ class ExpectationValueCollection(numpy.ndarray):
                 titles = list(titles)
             titles = titles + [None]*(len(data) - len(titles))
             traj = [None]*len(data)
+            copy = kwargs.get("copy", True)
             for i, col in enumerate(data):
-                traj[i] = ExpectationValueTrajectory(col, time, titles[i])
+                if not copy:
+                    col = array[i].view(numpy.ndarray)
+                traj[i] = ExpectationValueTrajectory(col, time, titles[i],
+                                                     dtype=array.dtype,
+                                                     copy=copy)
             array.evtrajectories = tuple(traj)
         if time is not None:
             array.time = time
@@ -119,7 +126,8 @@ class ExpectationValueCollection(numpy.ndarray):
             for key, value in subsystems.iteritems():
                 array.subsystems[key] = cls(
                         array[value[0]:value[1]:], array.time,
-                        array.titles[value[0]:value[1]:], copy=True)
+                        array.titles[value[0]:value[1]:],
+                        copy=kwargs.get("copy", True))
         return array
 
     def __array_finalize__(self, obj):
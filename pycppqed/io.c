@@ -1,43 +1,170 @@
+#define PY_SSIZE_T_CLEAN
 #include <Python.h>
 #include <numpy/arrayobject.h>
 #include <string.h>
+#include <stdlib.h>
+#include <locale.h>
+#ifdef __APPLE__
+#include <xlocale.h>
+#endif
+
+// Numbers are always parsed in the "C" locale, independent of the locale of
+// the process. The locale object is created once when the module is loaded.
+#ifdef _WIN32
+static _locale_t c_locale;
+#define C_STRTOD(str, endptr) _strtod_l(str, endptr, c_locale)
+#else
+static locale_t c_locale;
+#define C_STRTOD(str, endptr) strtod_l(str, endptr, c_locale)
+#endif
+
+// Skip blanks and return 1 if the next character is c.
+static int expect_char(char **next, const char *end, char c){
+    while (*next < end && (**next == ' ' || **next == '\t')) (*next)++;
+    return *next < end && **next == c;
+    }
+
+// Convert the number at pos like strtod without reading beyond end.
+// strtod itself needs a null-terminated string, so the number is copied into
+// a small buffer first. Numbers which don't fit are cut off and therefore
+// reported as malformed by the caller. *next never points beyond end.
+static double parse_number(const char *pos, const char *end, char **next){
+    char buf[64];
+    char *bufnext;
+    size_t n = 0;
+    double value;
+    while (pos + n < end && n < sizeof(buf) - 1 && pos[n] != ',' &&
+           pos[n] != ')') n++;
+    memcpy(buf, pos, n);
+    buf[n] = '\0';
+    value = C_STRTOD(buf, &bufnext);
+    *next = (char *)pos + (bufnext - buf);
+    return value;
+    }
+
+// Parse the complex numbers "(re,im)" between pos and end into data.
+// The input is not modified and doesn't have to be null-terminated, no
+// character at or beyond end is read.
+// Returns the number of parsed numbers or length+1 if there are more numbers
+// than fit into data. If the i-th number is malformed, -1-i is returned.
+// The numbers are always parsed in double precision and then stored as the
+// given type.
+#define DEFINE_PARSE_DATA(name, type) \
+static Py_ssize_t name(const char *pos, const char *end, type *data, \
+                       Py_ssize_t length){ \
+    char *next; \
+    Py_ssize_t i; \
+    for (i=0; i<length; i++){ \
+        pos = memchr(pos, '(', end - pos); \
+        if (pos == NULL) return i; \
+        data[2*i] = (type)parse_number(pos + 1, end, &next); \
+        if (next == pos + 1 || !expect_char(&next, end, ',')) return -1 - i; \
+        pos = next; \
+        data[2*i+1] = (type)parse_number(pos + 1, end, &next); \
+        if (next == pos + 1 || !expect_char(&next, end, ')')) return -1 - i; \
+        pos = next + 1; \
+        } \
+    if (pos < end && memchr(pos, '(', end - pos) != NULL) return length + 1; \
+    return length; \
+    }
+
+DEFINE_PARSE_DATA(parse_data, double)
+DEFINE_PARSE_DATA(parse_data_single, float)
+
+// Parse data into the given buffer with released GIL and set a Python
+// exception if the number of elements doesn't match. If single is true,
+// data points to single precision numbers.
+static int parse_buffer(const char *datastr, Py_ssize_t size, void *data,
+                        Py_ssize_t length, int single){
+    Py_ssize_t count;
+    Py_BEGIN_ALLOW_THREADS
+    if (single)
+        count = parse_data_single(datastr, datastr + size, (float*)data,
+                                  length);
+    else
+        count = parse_data(datastr, datastr + size, (double*)data, length);
+    Py_END_ALLOW_THREADS
+    if (count < 0){
+        PyErr_Format(PyExc_ValueError,
+                     "Blitz array has a malformed number at element %zd.",
+                     -1 - count);
+        return -1;
+        }
+    if (count < length){
+        PyErr_Format(PyExc_ValueError,
+                     "Blitz array has %zd instead of %zd elements.",
+                     count, length);
+        return -1;
+        }
+    if (count > length){
+        PyErr_Format(PyExc_ValueError,
+                     "Blitz array has more than %zd elements.", length);
+        return -1;
+        }
+    return 0;
+    }
 
 static PyObject *parse(PyObject *self, PyObject *args){
     // Read in arguments: datastr, length
-    char *datastr;
-    int length;
-    if (!PyArg_ParseTuple(args, "si", &datastr, &length)) return NULL;
+    // The data can be given as string or as any object supporting the buffer
+    // interface (e.g. a buffer of a memory mapped file). It is not modified.
+    const char *datastr;
+    Py_ssize_t size;
+    Py_ssize_t length;
+    if (!PyArg_ParseTuple(args, "s#n", &datastr, &size, &length)) return NULL;
 
     // Create Array with right dimensions, length and content.
-    int dims[1];
+    npy_intp dims[1];
     dims[0] = length;
     PyArrayObject *array = (PyArrayObject *)
-        PyArray_FromDims(1, dims, PyArray_CDOUBLE);
-
-    // Create pointer to data.
-    double *data;
-    data = (double*)array->data;
+        PyArray_SimpleNew(1, dims, NPY_CDOUBLE);
+    if (array == NULL) return NULL;
 
     // Go through the string and extract all numbers.
-    strtok(datastr, "(");
-    int i;
-    for (i=0; i<2*length; i+=2){
-        data[i] = strtod(strtok(NULL, ","), NULL);
-        data[i+1] = strtod(strtok(NULL, ")"), NULL);
-        strtok(NULL, "(");
+    if (parse_buffer(datastr, size, PyArray_DATA(array), length, 0)){
+        Py_DECREF(array);
+        return NULL;
         }
     return PyArray_Return(array);
     }
 
+static PyObject *parse_into(PyObject *self, PyObject *args){
+    // Read in arguments: datastr, array
+    const char *datastr;
+    Py_ssize_t size;
+    PyArrayObject *array;
+    if (!PyArg_ParseTuple(args, "s#O!", &datastr, &size,
+                          &PyArray_Type, &array)) return NULL;
+    if ((PyArray_TYPE(array) != NPY_CDOUBLE &&
+         PyArray_TYPE(array) != NPY_CFLOAT) || !PyArray_ISCARRAY(array)){
+        PyErr_SetString(PyExc_TypeError, "Array has to be a writeable, "
+                        "contiguous complex128 or complex64 array.");
+        return NULL;
+        }
+    if (parse_buffer(datastr, size, PyArray_DATA(array), PyArray_SIZE(array),
+                     PyArray_TYPE(array) == NPY_CFLOAT)) return NULL;
+    Py_RETURN_NONE;
+    }
+
 
 static PyMethodDef DataMethods[] = {
     {"parse", parse, METH_VARARGS, "Parse blitz array into numpy array."},
+    {"parse_into", parse_into, METH_VARARGS,
+        "Parse blitz array into the given contiguous complex array."},
     {NULL, NULL, 0, NULL},
     };
 
 
 PyMODINIT_FUNC initcio(void){
+#ifdef _WIN32
+    c_locale = _create_locale(LC_ALL, "C");
+#else
+    c_locale = newlocale(LC_ALL_MASK, "C", (locale_t)0);
+#endif
+    if (c_locale == 0){
+        PyErr_SetString(PyExc_ImportError, "Can't create C locale.");
+        return;
+        }
     Py_InitModule("cio", DataMethods);
     import_array();
     }
-
@@ -3,10 +3,34 @@ This module provides functions to read and write C++QED files.
 
 Most important are:
     * :func:`load_cppqed`
+    * :func:`load_expvalues`
+    * :func:`load_many`
     * :func:`load_statevector`
+    * :func:`load_statevectors`
     * :func:`save_statevector`
     * :func:`split_cppqed`
+    * :class:`LazyStateVectorTrajectory`
+    * :class:`CppqedFollower`
 """
+import os
+import re
+import glob
+import copy
+import string
+import shutil
+import tempfile
+import hashlib
+import inspect
+import exceptions
+import cPickle
+import cStringIO
+import mmap as _mmap
+import zlib
+import bz2
+import threading
+import Queue
+import multiprocessing
+import multiprocessing.pool
 import numpy
 import statevector
 import expvalues
@@ -19,77 +43,649 @@ try:
 except:
     print "C extension for 'io.py' is not used ..."
     cio = None
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+def _split_blitz(blitzstr):
+    """
+    Split a Blitz array into dimension string and data part.
+
+    The Blitz array can be a string or a buffer (e.g. of a memory mapped
+    file). The data part is returned as buffer, so it is not copied.
+    """
+    n = 128
+    while True:
+        head = blitzstr[:n]
+        pos = head.find("\n")
+        if pos != -1:
+            return head[:pos], buffer(blitzstr, pos+1)
+        if n >= len(blitzstr):
+            raise ValueError("Not a valid Blitz array.")
+        n *= 4
 
-def _blitz2numpy(blitzstr):
+def _blitz2numpy(blitzstr, dtype=complex):
     """
     Transform a string representation of a blitz array into a numpy array.
+
+    Instead of a string also a buffer object can be given. The numbers are
+    parsed in double precision and stored with the given complex *dtype*.
     """
     # Split array into dimension and data part.
-    dimstr, datastr = blitzstr.split("\n", 1)
-    # Parse dimension part.
+    dimstr, datastr = _split_blitz(blitzstr)
+    dims = _blitz_dims(dimstr)
+    length = reduce(int.__mul__, dims)
+    # Parse data part either with c-extension or with python code.
+    if cio is not None:
+        array = numpy.empty(length, dtype=dtype)
+        cio.parse_into(datastr, array)
+    else:
+        array = numpy.asarray(_parse_blitz_data(datastr, length), dtype)
+    return array.reshape(*dims)
+
+def _dtypes(dtype=None):
+    """
+    Return the real and the complex dtype with the precision of *dtype*.
+
+    *dtype* can be any real or complex single or double precision type, if
+    it is None double precision is used.
+    """
+    if dtype is None:
+        return numpy.dtype(float), numpy.dtype(complex)
+    cdtype = numpy.promote_types(dtype, numpy.complex64)
+    if cdtype not in (numpy.complex64, numpy.complex128):
+        raise ValueError("Only single and double precision are supported.")
+    return numpy.dtype(cdtype.char.lower()), cdtype
+
+def _blitz_dims(dimstr):
+    """
+    Return the shape given by the dimension part of a Blitz array.
+    """
     dimensions = eval("(%s,)" % dimstr.replace(" x ", ","))
     dims = []
     for d in dimensions:
         dims.append(d[1] - d[0] + 1)
-    length = reduce(int.__mul__, dims)
-    # Parse data part either with c-extension or with python code.
+    return tuple(dims)
+
+def _parse_blitz_into(datastr, out):
+    """
+    Parse the data part of a Blitz array into the given 1D complex array.
+    """
     if cio is not None:
-        import locale
-        locale.setlocale(locale.LC_ALL, "en_US.utf8")
-        array = numpy.array(cio.parse(datastr, length))
+        cio.parse_into(datastr, out)
     else:
-        array = numpy.empty(length, dtype="complex")
-        data = datastr.replace(" \n ", "").rstrip("\n")[3:-3].split(") (")
-        for i, entry in enumerate(data):
-            re, im = entry.split(",")
-            array[i] = complex(float(re), float(im))
-    return array.reshape(*dims)
+        out[:] = _parse_blitz_data(datastr, out.size)
+
+# Translation table replacing all delimiters of Blitz arrays by spaces.
+_BLITZ_DELIMITERS = string.maketrans("[(,)]", "     ")
+
+def _parse_blitz_data(datastr, length):
+    """
+    Parse the data part of a Blitz array with numpy.
+
+    This is the fallback if the C extension is not available. All brackets
+    and commas are replaced by spaces at once and the resulting stream of
+    numbers is parsed in bulk into a float array which is then viewed as
+    complex array.
+    """
+    data = numpy.fromstring(str(datastr).translate(_BLITZ_DELIMITERS),
+                            dtype=float, sep=" ")
+    if data.size != 2*length:
+        raise ValueError("Blitz array has %s instead of %s elements." % \
+                         (data.size/2., length))
+    return data.view(complex)
+
+# Number of complex values formatted at once when writing Blitz arrays.
+_BLITZ_CHUNKSIZE = 4096
+
+def _write_blitz(f, array):
+    """
+    Write the blitz array representation of the given array into a file.
+
+    The values are formatted in bulk in chunks of at most
+    :data:`_BLITZ_CHUNKSIZE` numbers which are written directly to the file,
+    so the whole string representation never has to be kept in memory.
+    """
+    array = numpy.asarray(array)
+    shape = array.shape
+    dims = []
+    for dim in shape:
+        dims.append("(%s,%s)" % (0, dim-1))
+    f.write("%s \n[ " % " x ".join(dims))
+    # Every row of the last dimension is written on its own line. The complex
+    # numbers are viewed as pairs of floats which are formatted at once.
+    length = shape[-1]
+    data = numpy.ascontiguousarray(array, dtype=complex)
+    data = data.reshape((-1, length)).view(float)
+    chunksize = min(length, _BLITZ_CHUNKSIZE)
+    fmt = " ".join(["(%r,%r)"]*chunksize)
+    for i, row in enumerate(data):
+        if i:
+            f.write(" \n  ")
+        for start in range(0, length, chunksize):
+            values = tuple(row[2*start:2*(start+chunksize)].tolist())
+            if start:
+                f.write(" ")
+            if len(values) == 2*chunksize:
+                f.write(fmt % values)
+            else:
+                f.write(" ".join(["(%r,%r)"]*(len(values)/2)) % values)
+    f.write(" ]\n\n")
 
 def _numpy2blitz(array):
     """
     Create blitz array string representation from the given numpy array.
     """
-    def data1D(array):
-        # Function handling 1D arrays.
-        datastr = ["(%s,%s)" % (number.real, number.imag) for number in array]
-        return " ".join(datastr)
-    def data2D(array):
-        # Function handling 2D arrays.
-        datastr = [data1D(row) for row in array]
-        return " \n  ".join(datastr)
-    def dataMD(array, dimensions):
-        # Function handling > 2D arrays.
-        dim0, otherdims = dimensions[0], dimensions[1:]
-        length = len(otherdims)
-        datastr = []
-        if length > 2:
-            for i in range(dim0[1] - dim0[0] + 1):
-                datastr.append(dataMD(array[i], otherdims))
-            return " \n  ".join(datastr)
-        elif length == 2:
-            for i in range(dim0[1] - dim0[0] + 1):
-                datastr.append(data2D(array[i]))
-            return " \n  ".join(datastr)
-    # Determine dimensionality of array.
-    if hasattr(array, "dimensions"):
-        dimensions = array.dimensions
-    else:
-        dimensions = array.shape
-    dimensions = [(0,dim-1) for dim in array.shape]
-    ndim = len(dimensions)
-    if ndim == 1:
-        datastr = data1D(array)
-    elif ndim == 2:
-        datastr = data2D(array)
-    elif ndim > 2:
-        datastr = dataMD(array, dimensions)
-    dims = []
-    for d in dimensions:
-        dims.append("(%s,%s)" % d)
-    dimensionstr = " x ".join(dims)
-    return "%s \n[ %s ]\n\n" % (dimensionstr, datastr)
+    f = cStringIO.StringIO()
+    _write_blitz(f, array)
+    return f.getvalue()
+
+class _ArrayStack:
+    """
+    A growing stack of equally shaped arrays.
+
+    Rows are copied into one contiguous buffer which is enlarged in place, so
+    that no list of single arrays has to be kept and stacked at the end.
+    """
+    def __init__(self, dtype=None):
+        self.dtype = dtype
+        self.buffer = None
+        self.length = 0
+        self.shared = False
+
+    def __len__(self):
+        return self.length
+
+    def _reserve(self, length):
+        # Make sure that the buffer can hold the given number of rows.
+        buf = self.buffer
+        if length <= buf.shape[0]:
+            return
+        shape = (max(2*buf.shape[0], length),) + buf.shape[1:]
+        if self.shared:
+            # Views of the old buffer exist, so it can't be resized.
+            self.buffer = numpy.empty(shape, buf.dtype)
+            self.buffer[:self.length] = buf[:self.length]
+            self.shared = False
+        else:
+            buf.resize(shape, refcheck=False)
+
+    def append(self, row):
+        if self.buffer is None:
+            row = numpy.asarray(row, dtype=self.dtype)
+            self.buffer = numpy.empty((16,) + row.shape, row.dtype)
+        else:
+            self._reserve(self.length + 1)
+        self.buffer[self.length] = row
+        self.length += 1
+
+    def extend(self, rows):
+        """
+        Append all rows of the given array at once.
+        """
+        rows = numpy.asarray(rows, dtype=self.dtype)
+        if self.buffer is None:
+            shape = (max(16, len(rows)),) + rows.shape[1:]
+            self.buffer = numpy.empty(shape, rows.dtype)
+        else:
+            self._reserve(self.length + len(rows))
+        self.buffer[self.length:self.length+len(rows)] = rows
+        self.length += len(rows)
+
+    def array(self):
+        """
+        Return the stacked rows and release the unused part of the buffer.
+        """
+        buf = self.buffer
+        if buf is None:
+            return numpy.empty((0,), dtype=self.dtype)
+        if self.length != buf.shape[0]:
+            buf.resize((self.length,) + buf.shape[1:], refcheck=False)
+        return buf
+
+    def view(self):
+        """
+        Return the stacked rows as view, more rows can still be appended.
+        """
+        if self.buffer is None:
+            return numpy.empty((0,), dtype=self.dtype)
+        self.shared = True
+        return self.buffer[:self.length]
+
+def _iter_cppqed_output(f, comment=True, follow=False, skip_sv=None):
+    """
+    Walk through an open C++QED output file and yield the records found.
+
+    *Arguments*
+        * *f*
+            A file like object opened for reading. Only its ``readline``
+            method is used.
+
+        * *comment* (optional)
+            If False the file is expected to be positioned behind the
+            comment section. (Default is True)
+
+        * *follow* (optional)
+            If True the file may still be written. An incomplete record at
+            the end of the file is not yielded and ends the iteration
+            without error. Directly after a record was yielded, the file
+            position points to the end of this record. (Default is False)
+
+        * *skip_sv* (optional)
+            A function which is called without arguments whenever a state
+            vector is found. If it returns True the state vector is skipped
+            without being stored or yielded.
+
+    *Yields*
+        Tuples ``(kind, data)`` in the order they appear in the file:
+            * ``("comment", commentstr)`` - The first record if *comment*
+              is True.
+            * ``("ev", evstr)`` - One row of expectation values.
+            * ``("basis", (name, blitzstr))`` - A basis for the following
+              state vectors.
+            * ``("sv", blitzstr)`` - A state vector as Blitz array string.
+
+    The file is read line by line, so at most one Blitz array is held in
+    memory at any time.
+    """
+    readline = f.readline
+    line = readline()
+    if comment:
+        # Read comment section.
+        comments = []
+        while line and line[0] in ("\n", "#"):
+            comments.append(line)
+            line = readline()
+        if follow and not line:
+            return
+        yield "comment", "".join(comments).rstrip("\n")
+    name = None
+    while line:
+        first = line[0]
+        if first == "(":
+            # Start of a Blitz array - read on until its closing bracket.
+            skip = name is None and skip_sv is not None and skip_sv()
+            lines = [line]
+            while "]" not in line:
+                line = readline()
+                if not line:
+                    if follow:
+                        return
+                    raise ValueError("Unexpected end of file in Blitz array.")
+                if not skip:
+                    lines.append(line)
+            if skip:
+                line = readline()
+                continue
+            lines[-1] = line[:line.rfind("]")+1]
+            blitzstr = "".join(lines)
+            if name is None:
+                yield "sv", blitzstr
+            else:
+                yield "basis", (name, blitzstr)
+                name = None
+        elif first == "#":
+            name = line[1:].strip()
+        elif not line.isspace():
+            if follow and not line.endswith("\n"):
+                return
+            yield "ev", line.rstrip("\r\n")
+        line = readline()
+
+def _iter_mapped_cppqed_output(buf, offsets=False, evblocks=False,
+                               skip_sv=None):
+    """
+    Walk through a memory mapped C++QED output file and yield its records.
+
+    *Arguments*
+        * *buf*
+            A :class:`mmap.mmap` object (or a string) holding the file.
+
+        * *offsets* (optional)
+            If True Blitz arrays are given as tuples ``(start, end)`` of
+            their position in the file. (Default is False)
+
+        * *evblocks* (optional)
+            If True consecutive rows of expectation values are yielded
+            together as one record ``("evs", evsstr)``. (Default is False)
+
+        * *skip_sv* (optional)
+            A function which is called without arguments whenever a state
+            vector is found. If it returns True the state vector is skipped.
+
+    *Yields*
+        The same records as :func:`_iter_cppqed_output`, but Blitz arrays
+        are given as buffer objects pointing directly into the mapped file.
+        These buffers are only valid as long as the map is open.
+
+    Record boundaries are located with ``find`` on the map, so the text of
+    the state vectors is never copied.
+    """
+    length = len(buf)
+    # Find end of comment section.
+    pos = 0
+    while pos < length and buf[pos] in ("\n", "#"):
+        pos = buf.find("\n", pos) + 1
+        if pos == 0:
+            pos = length
+    yield "comment", buf[:pos].rstrip("\n")
+    name = None
+    while pos < length:
+        first = buf[pos]
+        if first == "(":
+            end = buf.find("]", pos)
+            if end == -1:
+                raise ValueError("Unexpected end of file in Blitz array.")
+            if offsets:
+                blitzstr = (pos, end+1)
+            else:
+                blitzstr = buffer(buf, pos, end+1-pos)
+            if name is None:
+                if skip_sv is None or not skip_sv():
+                    yield "sv", blitzstr
+            else:
+                yield "basis", (name, blitzstr)
+                name = None
+            pos = buf.find("\n", end) + 1
+        elif first == "#":
+            end = buf.find("\n", pos)
+            name = buf[pos+1:end].strip()
+            pos = end + 1
+        else:
+            # Expectation values reach until the next Blitz array or basis.
+            end = buf.find("\n(", pos)
+            if end == -1:
+                end = length
+            basis_start = buf.find("\n#", pos, end)
+            if basis_start != -1:
+                end = basis_start
+            if evblocks:
+                block = buf[pos:end]
+                if block and not block.isspace():
+                    yield "evs", block
+            else:
+                for line in buf[pos:end].splitlines():
+                    if line and not line.isspace():
+                        yield "ev", line
+            pos = end + 1
+        if pos == 0:
+            break
+
+class _Selection:
+    """
+    Decides which records of a C++QED output file are used.
+
+    *Arguments*
+        * *tmin*, *tmax*
+            Only records with a time in this interval are used. None means
+            that there is no limit.
+
+        * *ev_every*, *sv_every*
+            Only every n-th row of expectation values and every n-th state
+            vector (counted within the time interval) are used.
+
+    :meth:`ev` has to be called for every row of expectation values in the
+    file, it also remembers the time of the last row which is the time of
+    following state vectors.
+    """
+    def __init__(self, tmin=None, tmax=None, ev_every=1, sv_every=1):
+        self.tmin = tmin
+        self.tmax = tmax
+        self.ev_every = ev_every
+        self.sv_every = sv_every
+        self.evcount = 0
+        self.svcount = 0
+        self.time = None
+        self.ncolumns = None # Number of expectation values in a row
+
+    def key(self):
+        """
+        Return a tuple describing this selection.
+        """
+        return (self.tmin, self.tmax, self.ev_every, self.sv_every)
+
+    def inside(self, time):
+        """
+        Return True if the given time is inside of the time interval.
+        """
+        if time is None:
+            return False
+        return (self.tmin is None or self.tmin <= time) and \
+               (self.tmax is None or time <= self.tmax)
+
+    def ev(self, evstr):
+        """
+        Return True if the given row of expectation values is used.
+        """
+        self.time = time = float(evstr.split(None, 1)[0])
+        if self.ncolumns is None:
+            self.ncolumns = len(evstr.split())
+        if not self.inside(time):
+            return False
+        self.evcount += 1
+        return (self.evcount - 1) % self.ev_every == 0
+
+    def sv(self):
+        """
+        Return True if the next state vector is used.
+        """
+        if not self.inside(self.time):
+            return False
+        self.svcount += 1
+        return (self.svcount - 1) % self.sv_every == 0
+
+    def skip_sv(self):
+        """
+        Return True if the next state vector is skipped.
+        """
+        return not self.sv()
+
+    def finished(self):
+        """
+        Return True if the last row of expectation values is behind tmax.
+
+        Times in a C++QED output file increase, so no further record is used.
+        """
+        return self.tmax is not None and self.time is not None and \
+               self.time > self.tmax
+
+def _selection(tmin=None, tmax=None, every=None, ev_every=None, sv_every=None):
+    """
+    Create a :class:`_Selection` or return None if everything is selected.
+    """
+    ev_every = ev_every or every or 1
+    sv_every = sv_every or every or 1
+    if tmin is None and tmax is None and ev_every == 1 and sv_every == 1:
+        return None
+    return _Selection(tmin, tmax, ev_every, sv_every)
+
+_COMPRESSION_MAGIC = (
+    ("gz", "\x1f\x8b"),
+    ("bz2", "BZh"),
+    ("xz", "\xfd7zXZ\x00"),
+    )
 
-def _split_cppqed_output(filename, ev_handler, sv_handler, basis_handler):
+def _compression(filename):
+    """
+    Return the compression format of the given file or None.
+
+    The format ("gz", "bz2" or "xz") is detected by the magic bytes at the
+    beginning of the file, the file name doesn't matter.
+    """
+    f = open(filename, "rb")
+    try:
+        magic = f.read(6)
+    finally:
+        f.close()
+    for name, m in _COMPRESSION_MAGIC:
+        if magic.startswith(m):
+            return name
+    return None
+
+def _decompressor(compression):
+    """
+    Return a new decompressor object for the given compression format.
+    """
+    if compression == "gz":
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif compression == "bz2":
+        return bz2.BZ2Decompressor()
+    elif lzma is None:
+        raise ValueError("Reading xz compressed files needs the lzma module.")
+    return lzma.LZMADecompressor()
+
+_DECOMPRESS_CHUNKSIZE = 1<<18
+
+class _DecompressedFile:
+    """
+    A read-only file object which decompresses a file in a background thread.
+
+    The compressed file is read and decompressed by a separate thread which
+    hands over the decompressed chunks through a bounded queue. Since zlib
+    and bz2 release the GIL while working, decompression and parsing of the
+    already decompressed data run in parallel.
+
+    *Arguments*
+        * *filename*
+            Path to the compressed file.
+
+        * *compression*
+            The compression format as returned by :func:`_compression`.
+
+        * *queuesize* (optional)
+            Number of decompressed chunks which can be waiting in the queue.
+    """
+    def __init__(self, filename, compression, queuesize=8):
+        self.name = filename
+        self._raw = open(filename, "rb")
+        self._compression = compression
+        # Raise errors like missing modules here and not in the thread.
+        _decompressor(compression)
+        self._queue = Queue.Queue(queuesize)
+        self._stop = False
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+        self._thread = threading.Thread(target=self._decompress)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def _decompress(self):
+        put = self._queue.put
+        try:
+            d = _decompressor(self._compression)
+            while not self._stop:
+                data = self._raw.read(_DECOMPRESS_CHUNKSIZE)
+                if not data:
+                    break
+                while data and not self._stop:
+                    chunk = d.decompress(data)
+                    if chunk:
+                        put(chunk)
+                    data = d.unused_data
+                    if data:
+                        # Concatenated streams, e.g. made by "cat a.gz b.gz".
+                        d = _decompressor(self._compression)
+        except Exception, e:
+            put(e)
+        put(None)
+
+    def _fill(self):
+        if self._eof:
+            return False
+        chunk = self._queue.get()
+        if chunk is None:
+            self._eof = True
+            return False
+        if isinstance(chunk, Exception):
+            self._eof = True
+            raise IOError("Error while decompressing '%s': %s"
+                          % (self.name, chunk))
+        self._buf = chunk
+        self._pos = 0
+        return True
+
+    def readline(self):
+        pieces = []
+        while True:
+            i = self._buf.find("\n", self._pos)
+            if i != -1:
+                pieces.append(self._buf[self._pos:i+1])
+                self._pos = i + 1
+                break
+            pieces.append(self._buf[self._pos:])
+            self._buf = ""
+            self._pos = 0
+            if not self._fill():
+                break
+        return "".join(pieces)
+
+    def read(self, size=-1):
+        pieces = [self._buf[self._pos:]]
+        length = len(pieces[0])
+        self._buf = ""
+        self._pos = 0
+        while (size < 0 or length < size) and self._fill():
+            pieces.append(self._buf)
+            length += len(self._buf)
+            self._buf = ""
+        data = "".join(pieces)
+        if size >= 0 and len(data) > size:
+            self._buf = data[size:]
+            data = data[:size]
+        return data
+
+    def __iter__(self):
+        return iter(self.readline, "")
+
+    def close(self):
+        if self._thread is None:
+            return
+        self._stop = True
+        # Unblock the thread if it waits for space in the queue.
+        while self._thread.isAlive():
+            try:
+                self._queue.get(timeout=0.01)
+            except Queue.Empty:
+                pass
+        self._thread = None
+        self._raw.close()
+
+def _open_cppqed(filename):
+    """
+    Open a C++QED output or state vector file for reading.
+
+    Files compressed with gzip, bzip2 or xz are recognized and returned as
+    :class:`_DecompressedFile`, other files are opened normally.
+    """
+    compression = _compression(filename)
+    if compression is None:
+        return open(filename)
+    return _DecompressedFile(filename, compression)
+
+def _open_mapped(filename):
+    """
+    Open the given file and map it read-only into memory.
+
+    Returns None if the file can't be mapped (e.g. because it is empty or
+    compressed).
+    """
+    if _compression(filename) is not None:
+        return None
+    f = open(filename)
+    try:
+        return _mmap.mmap(f.fileno(), 0, access=_mmap.ACCESS_READ)
+    except (ValueError, EnvironmentError):
+        return None
+    finally:
+        f.close()
+
+def _split_cppqed_output(filename, ev_handler, sv_handler, basis_handler,
+                         mmap=False, selection=None, comment_handler=None):
     """
     Split a C++QED output file into expectation values and statevectors.
 
@@ -107,49 +703,468 @@ def _split_cppqed_output(filename, ev_handler, sv_handler, basis_handler):
         * *basis_handler*
             A function that will be called when a basis vector is found.
 
+        * *mmap* (optional)
+            If True the file is memory mapped and the handlers get buffers
+            pointing into the map instead of strings. These buffers must not
+            be used after the handler returned. (Default is False)
+
+        * *selection* (optional)
+            A :class:`_Selection` specifying which expectation values and
+            state vectors are handled. The others are skipped without being
+            parsed.
+
+        * *comment_handler* (optional)
+            A function that will be called with the comment section before
+            any other handler is called.
+
     *Returns*
         * *commentstr*
             A string containing the comment section of the C++QED output file.
     """
-    f = open(filename)
-    buf = f.read()
-    f.close()
-    # Find end of comment section.
-    pos = 0
-    while buf[pos] in ("\n", "#"):
-        pos = buf.find("\n\n", pos) + 2
-        assert pos != -1
-    # Store comments in Info object.
-    commentstr = buf[:pos-2]
-    # Eliminate comment section from buffer.
-    buf = buf[pos:]
-    pos = 0
-    length = len(buf)
-    while pos < length:
-        # Find start of next state vector.
-        sv_start = buf.find("\n(", pos)
-        ev_end = buf.find("\n#", pos, sv_start)
-        if ev_end == -1:
-            ev_end = sv_start
+    if mmap:
+        f = _open_mapped(filename)
+    if not mmap or f is None:
+        f = _open_cppqed(filename)
+    if selection is None:
+        skip_sv = None
+    else:
+        skip_sv = selection.skip_sv
+    try:
+        if isinstance(f, _mmap.mmap):
+            records = _iter_mapped_cppqed_output(f, skip_sv=skip_sv)
         else:
-            name = buf[ev_end+2:sv_start].strip()
-            basis_start = sv_start
-            basis_end = buf.find("]", basis_start)
-            sv_start = buf.find("\n(", basis_end)
-            basis_handler(name, buf[basis_start+1:basis_end+1])
-        # Handle the expectation values that were calculated before the state
-        # vector.
-        map(ev_handler, buf[pos:ev_end].splitlines())
-        # If there is no other state vector stop searching.
-        if sv_start == -1:
-            break
-        sv_end = buf.find("]", sv_start)
-        assert sv_end != -1
-        sv_handler(buf[sv_start+1:sv_end+1])
-        pos = sv_end + 2
+            records = _iter_cppqed_output(f, skip_sv=skip_sv)
+        kind, commentstr = records.next()
+        if comment_handler is not None:
+            comment_handler(commentstr)
+        for kind, data in records:
+            if kind == "ev":
+                if selection is None or selection.ev(data):
+                    ev_handler(data)
+                elif selection.finished():
+                    break
+            elif kind == "sv":
+                sv_handler(data)
+            else:
+                basis_handler(*data)
+    finally:
+        f.close()
     return commentstr
 
-def load_cppqed(filename):
+class _CppqedCollector:
+    """
+    Collects the records of a C++QED output file in growing arrays.
+
+    The methods :meth:`ev_handler`, :meth:`sv_handler` and
+    :meth:`basis_handler` can be given to :func:`_split_cppqed_output`. If
+    a :class:`_Selection` is used, it has to be given here too, because it
+    knows the times of skipped rows.
+    """
+    def __init__(self, selection=None, subsystems=None, dtype=None):
+        self.selection = selection
+        self.subsystems = subsystems
+        self.columns = None # Indices of the stored expectation values
+        self.commentstr = None
+        self.evdtype, self.svdtype = _dtypes(dtype)
+        self.evs = _ArrayStack(self.evdtype) # Expectation values
+        if self.evdtype == numpy.float64:
+            self.evtimes = None # Times are taken from evs
+        else:
+            self.evtimes = _ArrayStack(float) # Times in double precision
+        self.svs = _ArrayStack(self.svdtype) # State vectors
+        self.svtimes = _ArrayStack(float) # Time of every state vector
+        self.svbases = _ArrayStack(int) # Basis index of every state vector
+        self.bases = [] # Found bases
+        self.evtime = None # Time of last expectation value row
+
+    def comment_handler(self, commentstr):
+        self.commentstr = commentstr
+        if self.subsystems is not None:
+            self.columns = _expvalue_columns(commentstr, self.subsystems)
+
+    def ev_handler(self, evstr):
+        if self.columns is None:
+            parts = evstr.split("\t")
+            ev = []
+            for part in parts:
+                ev.extend(map(float, part.split()))
+        else:
+            parts = evstr.split()
+            ev = [float(parts[i]) for i in self.columns]
+        self.evs.append(ev)
+        self.evtime = ev[0]
+        if self.evtimes is not None:
+            self.evtimes.append(ev[0])
+
+    def sv_handler(self, svstr):
+        if self.selection is None:
+            self.svtimes.append(self.evtime)
+        else:
+            self.svtimes.append(self.selection.time)
+        self.svs.append(_blitz2numpy(svstr, self.svdtype))
+        self.svbases.append(len(self.bases) - 1)
+
+    def basis_handler(self, name, svstr):
+        self.bases.append((name, _blitz2numpy(svstr)))
+
+    def data(self, view=False):
+        """
+        Return the collected data in the form returned by :func:`_parse_cppqed`.
+
+        If *view* is True the arrays are views of the growing buffers and
+        further records can still be collected.
+        """
+        if view:
+            evs, svs = self.evs.view(), self.svs.view()
+            svtimes, svbases = self.svtimes.view(), self.svbases.view()
+        else:
+            evs, svs = self.evs.array(), self.svs.array()
+            svtimes, svbases = self.svtimes.array(), self.svbases.array()
+        if not len(self.svtimes):
+            svs = None
+        if self.columns is None and self.selection is not None:
+            ncols = self.selection.ncolumns
+        else:
+            ncols = None
+        evs = _expvalue_rows(evs, self.commentstr, self.columns, ncols)
+        if self.evtimes is None:
+            evtimes = evs[0]
+        elif view:
+            evtimes = self.evtimes.view()
+        else:
+            evtimes = self.evtimes.array()
+        return (self.commentstr, evs, evtimes, svs, svtimes, svbases,
+                list(self.bases))
+
+def _parse_cppqed(filename, mmap=False, selection=None, subsystems=None,
+                  dtype=None):
+    """
+    Parse a C++QED output file into plain arrays.
+
+    Only the records chosen by the given :class:`_Selection` are parsed and
+    only the expectation values of the given subsystems are stored (see
+    :func:`_expvalue_columns`). The arrays are stored with the precision of
+    *dtype* (see :func:`_dtypes`).
+
+    *Returns*
+        * *data*
+            A tuple ``(commentstr, evs, evtimes, svs, svtimes, svbases,
+            bases)``:
+                * *commentstr* - The comment section.
+                * *evs* - 2D array with one row for every expectation value.
+                * *evtimes* - Array with the time of every row of *evs* in
+                  double precision, also if *evs* has single precision.
+                * *svs* - Array holding all state vectors (or None).
+                * *svtimes* - Array with the time of every state vector.
+                * *svbases* - Array with the index of the basis of every
+                  state vector in *bases* (-1 if there is none).
+                * *bases* - List of ``(name, states)`` tuples.
+    """
+    c = _CppqedCollector(selection, subsystems, dtype)
+    _split_cppqed_output(filename, c.ev_handler, c.sv_handler,
+                         c.basis_handler, mmap, selection, c.comment_handler)
+    return c.data()
+
+def _expvalue_layout(commentstr):
+    """
+    Return the layout of the expectation values described in a comment section.
+
+    *Returns*
+        * *titles*
+            A list with the titles of all expectation values.
+
+        * *subsystems*
+            An ordered dictionary mapping the names of the subsystems
+            (e.g. ``"(1)Mode"``) to the range ``(start, end)`` of their
+            expectation values.
+
+        * *systems*
+            A list with the quantum system classes of all subsystems.
+
+        * *ntrajectory*
+            The number of leading expectation values which don't belong to
+            a subsystem (e.g. time and time step).
+    """
+    desc = description.Description(commentstr)
+    titles = []
+    subsystems = utils.OrderedDict()
+    start = 0
+    _systems = desc.quantumsystem.subsystems
+    length = len(_systems)
+    ntrajectory = 0
+    for i, subs in enumerate(desc.expvalues.subsystems):
+        titles.extend(subs.entrys.values())
+        end = len(titles)
+        if i == 0:
+            ntrajectory = end
+        if 0<i<=length:
+            subsystems["(%s)%s" % (i-1, _systems[i-1].__name__)] = (start, end)
+        start = end
+    return titles, subsystems, _systems, ntrajectory
+
+def _expvalue_columns(commentstr, subsystems):
+    """
+    Return the indices of the expectation values of the given subsystems.
+
+    *Arguments*
+        * *commentstr*
+            The comment section of the C++QED output file.
+
+        * *subsystems*
+            A subsystem or a list of subsystems. A subsystem can be given as
+            its number, by its full name (e.g. ``"(1)Mode"``), by the name
+            of its class (e.g. ``"Mode"`` selects all modes) or by the title
+            of a single expectation value.
+
+    The leading expectation values which don't belong to a subsystem (e.g.
+    the time) are always included.
+    """
+    try:
+        titles, ranges, _systems, ntrajectory = _expvalue_layout(commentstr)
+    except:
+        raise ValueError("Can't select subsystems, comment section of the "
+                         "C++QED output file couldn't be read.")
+    if isinstance(subsystems, (int, basestring)):
+        subsystems = (subsystems,)
+    names = ranges.keys()
+    columns = set(range(ntrajectory))
+    for subsystem in subsystems:
+        if isinstance(subsystem, int):
+            if not 0 <= subsystem < len(names):
+                raise ValueError("There is no subsystem %s." % subsystem)
+            columns.update(range(*ranges[names[subsystem]]))
+            continue
+        found = False
+        for name in names:
+            if subsystem == name or subsystem == name[name.find(")")+1:]:
+                columns.update(range(*ranges[name]))
+                found = True
+        for i, title in enumerate(titles):
+            if subsystem == title:
+                columns.add(i)
+                found = True
+        if not found:
+            raise ValueError("Unknown subsystem or expectation value: %s" % \
+                             subsystem)
+    return sorted(columns)
+
+def _expvalue_rows(evs, commentstr, columns=None, ncols=None):
+    """
+    Return the stacked rows of expectation values with one row per column.
+
+    If no rows were found, an empty array is returned. Its number of rows is
+    given by *columns*, *ncols* (the length of a skipped row) or the
+    comment section.
+    """
+    if evs.ndim == 2:
+        return evs.swapaxes(0,1)
+    if columns is not None:
+        ncols = len(columns)
+    elif ncols is None:
+        try:
+            ncols = len(_expvalue_layout(commentstr)[0])
+        except:
+            ncols = 0
+    return numpy.empty((max(ncols, 1), 0), dtype=evs.dtype)
+
+def _build_expvalues(commentstr, evs, columns=None, time=None):
+    """
+    Create an ExpectationValueCollection for the given comment section.
+
+    *Arguments*
+        * *commentstr*
+            The comment section of the C++QED output file.
+
+        * *evs*
+            2D array with one row for every expectation value.
+
+        * *columns* (optional)
+            If only some expectation values were loaded, a sorted list with
+            their indices.
+
+        * *time* (optional)
+            Array with the points of time. (Default is None which means the
+            first row of *evs* is used)
+
+    *Returns*
+        * *evstraj*
+            A :class:`pycppqed.expvalues.ExpectationValueCollection` using
+            the given array of expectation values without copying it.
+
+        * *systems*
+            List of the quantum system classes of all subsystems or None if
+            the comment section couldn't be read.
+    """
+    if time is None:
+        time = evs[0,:]
+    try:
+        titles, subsystems, _systems, ntrajectory = \
+                _expvalue_layout(commentstr)
+    except:
+        print "Error while reading commentsection, please contact maintainer."
+        titles = []
+        subsystems = utils.OrderedDict()
+        _systems = None
+    if columns is not None:
+        # Adjust titles and subsystems to the reduced set of columns.
+        titles = [(titles[i] if i < len(titles) else None) for i in columns]
+        reduced = utils.OrderedDict()
+        for name, (start, end) in subsystems.items():
+            indices = [j for j, i in enumerate(columns) if start <= i < end]
+            if indices:
+                reduced[name] = (indices[0], indices[-1]+1)
+        subsystems = reduced
+    evstraj = expvalues.ExpectationValueCollection(evs, time=time,
+                            titles=titles, subsystems=subsystems, copy=False)
+    return evstraj, _systems
+
+def _basis_object(name, states):
+    """
+    Return the basis object for the states of a basis found in a file.
+    """
+    BASES = pycppqed.BASES
+    if name in BASES:
+        return BASES[name](states)
+    return states
+
+def _build_cppqed(commentstr, evs, evtimes, svs, svtimes, svbases, bases,
+                  columns=None, svbasisobjects=None):
+    """
+    Create the objects returned by :func:`load_cppqed` from plain arrays.
+
+    The arguments are the ones returned by :func:`_parse_cppqed` and the
+    indices of the loaded expectation values if not all were loaded. The
+    given arrays are used without copying them. If the basis objects of
+    the state vectors are already known, they can be given as
+    *svbasisobjects*.
+    """
+    if svs is not None and svbasisobjects is None:
+        basisobjects = [_basis_object(*basis) for basis in bases]
+        svbasisobjects = [(basisobjects[i] if i >= 0 else None)
+                          for i in svbases]
+    if svs is not None:
+        svbases = svbasisobjects
+        svstraj = statevector.StateVectorTrajectory(svs, time=svtimes,
+                                        bases=svbases, copy=False)
+    else:
+        svstraj = statevector.StateVectorTrajectory([])
+    evstraj, _systems = _build_expvalues(commentstr, evs, columns, evtimes)
+    if _systems is None:
+        qs = quantumsystem.QuantumSystemCompound(svstraj)
+    else:
+        qs = quantumsystem.QuantumSystemCompound(svstraj, *_systems)
+    return evstraj, qs
+
+def _cache_path(filename, cachedir=None):
+    """
+    Return the path of the cache directory belonging to the given file.
+    """
+    if cachedir is None:
+        return "%s.cache" % filename
+    name = hashlib.md5(os.path.abspath(filename)).hexdigest()
+    return os.path.join(cachedir, name)
+
+def _cache_key(filename, options=None):
+    """
+    Return a key which changes whenever the given file changes.
+
+    *options* can be any picklable object describing how the file was loaded.
+    """
+    st = os.stat(filename)
+    return (os.path.abspath(filename), st.st_size, st.st_mtime, options)
+
+def _load_cache(filename, cachedir=None, options=None):
+    """
+    Load the cached data of a C++QED output file.
+
+    The arrays are memory mapped (copy-on-write) from the cache directory.
+    If there is no valid cache for the file, None is returned.
+    """
+    path = _cache_path(filename, cachedir)
+    try:
+        f = open(os.path.join(path, "info.pickle"), "rb")
+        try:
+            info = cPickle.load(f)
+        finally:
+            f.close()
+    except (EnvironmentError, EOFError, cPickle.UnpicklingError):
+        return None
+    if info.get("key") != _cache_key(filename, options) or \
+            "evtimes" not in info:
+        return None
+    def load(name, mmap_mode="c"):
+        return numpy.load(os.path.join(path, "%s.npy" % name),
+                          mmap_mode=mmap_mode)
+    if info["svs"]:
+        svs = load("svs")
+    else:
+        svs = None
+    evs = load("evs")
+    if info["evtimes"]:
+        evtimes = load("evtimes", None)
+    else:
+        evtimes = evs[0]
+    return (info["commentstr"], evs, evtimes, svs, load("svtimes", None),
+            load("svbases", None), info["bases"])
+
+def _save_cache(filename, data, cachedir=None, options=None):
+    """
+    Save the parsed data of a C++QED output file into its cache directory.
+    """
+    path = _cache_path(filename, cachedir)
+    commentstr, evs, evtimes, svs, svtimes, svbases, bases = data
+    # Times are stored separately only if they have a higher precision.
+    separate = evtimes.dtype != evs.dtype
+    tmppath = tempfile.mkdtemp(prefix=".pycppqed_cache_",
+                               dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        numpy.save(os.path.join(tmppath, "evs.npy"), evs)
+        if separate:
+            numpy.save(os.path.join(tmppath, "evtimes.npy"), evtimes)
+        numpy.save(os.path.join(tmppath, "svtimes.npy"), svtimes)
+        numpy.save(os.path.join(tmppath, "svbases.npy"), svbases)
+        if svs is not None:
+            numpy.save(os.path.join(tmppath, "svs.npy"), svs)
+        info = {
+            "key": _cache_key(filename, options),
+            "commentstr": commentstr,
+            "evtimes": separate,
+            "svs": svs is not None,
+            "bases": bases,
+            }
+        f = open(os.path.join(tmppath, "info.pickle"), "wb")
+        try:
+            cPickle.dump(info, f, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.rename(tmppath, path)
+    except:
+        shutil.rmtree(tmppath, ignore_errors=True)
+        raise
+
+def _cache_options(selection, subsystems, dtype=None):
+    """
+    Return the options under which a cache of the parsed data is stored.
+    """
+    if dtype is not None:
+        dtype = _dtypes(dtype)[1].name
+        if dtype == "complex128":
+            dtype = None
+    if selection is None and subsystems is None and dtype is None:
+        return None
+    elif selection is None:
+        key = None
+    else:
+        key = selection.key()
+    if dtype is None:
+        return (key, subsystems)
+    return (key, subsystems, dtype)
+
+def load_cppqed(filename, mmap=False, cache=False, tmin=None, tmax=None,
+                every=None, ev_every=None, sv_every=None, subsystems=None,
+                dtype=None):
     """
     Load a C++QED output file from the given location.
 
@@ -158,7 +1173,46 @@ def load_cppqed(filename):
 
     *Arguments*
         * *filename*
-            Path to the C++QED output file that should be loaded.
+            Path to the C++QED output file that should be loaded. The file
+            may be compressed with gzip, bzip2 or xz.
+
+        * *mmap* (optional)
+            If True the file is memory mapped and the state vectors are
+            parsed directly from the map. Compressed files are never
+            mapped. (Default is False)
+
+        * *cache* (optional)
+            If True the parsed arrays are stored in binary form in the
+            directory ``{filename}.cache``. Instead of True also the path of
+            a directory can be given where the cache should be stored.
+            (Default is False)
+
+        * *tmin*, *tmax* (optional)
+            Only expectation values and state vectors with a time in this
+            interval are loaded. (Default is None which means no limit)
+
+        * *every* (optional)
+            Only every n-th row of expectation values and every n-th state
+            vector within the time interval are loaded. (Default is 1)
+
+        * *ev_every*, *sv_every* (optional)
+            Like *every* but only for expectation values or state vectors.
+            They take precedence over *every*.
+
+        * *subsystems* (optional)
+            Only load the expectation values of the given subsystems. Either
+            a single subsystem or a list of subsystems can be given, where
+            every subsystem is specified by its number, its full name (e.g.
+            ``"(1)Mode"``), its class name (e.g. ``"Mode"`` for all modes)
+            or by the title of a single expectation value. Time and time
+            step are always loaded. (Default is None which means all)
+
+        * *dtype* (optional)
+            Precision in which the data is stored. With ``numpy.complex64``
+            (or ``numpy.float32``) state vectors are stored as complex64 and
+            expectation values, including the time, as float32, which halves
+            the memory needed. The numbers are always parsed in double
+            precision. (Default is None which means double precision)
 
     *Returns*
         * *evs*
@@ -167,56 +1221,492 @@ def load_cppqed(filename):
         * *qs*
             A :class:`pycppqed.quantumsystem.QuantumSystem` holding all
             state vectors and information about the calculated system.
+
+    The file is parsed as a stream, every state vector is converted as soon as
+    it is read and stored directly in the resulting trajectory. Records that
+    are not selected are skipped without being parsed.
+
+    If a cache is used, following calls of this function don't parse the
+    file again but memory map the stored arrays. The cache is renewed
+    automatically when size or modification time of the file change.
     """
-    # Define handlers for state vector strings and expectation values strings.
-    evs = [] # Expectation values
-    svs = [] # State vectors
-    basis = [None] # Holds last basis vector
-    def ev_handler(evstr):
-        parts = evstr.split("\t")
-        ev = []
-        for part in parts:
-            ev.extend(map(float, part.split()))
-        evs.append(ev)
-    def sv_handler(svstr):
-        t = evs[-1][0]
-        ba = _blitz2numpy(svstr)
-        svs.append(statevector.StateVector(ba, t, basis=basis[0]))
-    def basis_handler(name, svstr):
-        states = _blitz2numpy(svstr)
-        BASES = pycppqed.BASES
-        if name in BASES:
-            basis[0] = BASES[name](states)
+    selection = _selection(tmin, tmax, every, ev_every, sv_every)
+    if cache:
+        if cache is True:
+            cachedir = None
         else:
-            basis[0] = states
-    commentstr = _split_cppqed_output(filename, ev_handler, sv_handler,
-                                      basis_handler)
-    evs = numpy.array(evs).swapaxes(0,1)
-    svstraj = statevector.StateVectorTrajectory(svs)
-    time = evs[0,:]
-    titles = []
-    subsystems = utils.OrderedDict()
+            cachedir = cache
+        options = _cache_options(selection, subsystems, dtype)
+        data = _load_cache(filename, cachedir, options)
+        if data is None:
+            data = _parse_cppqed(filename, mmap, selection, subsystems, dtype)
+            try:
+                _save_cache(filename, data, cachedir, options)
+            except EnvironmentError:
+                print "Can't write cache for '%s'." % filename
+    else:
+        data = _parse_cppqed(filename, mmap, selection, subsystems, dtype)
+    if subsystems is None:
+        columns = None
+    else:
+        columns = _expvalue_columns(data[0], subsystems)
+    return _build_cppqed(columns=columns, *data)
+
+def _load_many_worker(args):
+    """
+    Parse one C++QED output file and store the arrays in the given cache.
+
+    Runs in a worker process of :func:`load_many`. Returns None on success
+    and otherwise the name and message of the exception, because not all
+    exceptions can be pickled.
+    """
+    filename, cachedir, kwargs = args
     try:
-        desc = description.Description(commentstr)
-    except:
-        print "Error while reading commentsection, please contact maintainer."
-        qs = quantumsystem.QuantumSystemCompound(svstraj)
+        load_cppqed(filename, cache=cachedir, **kwargs)
+    except Exception, e:
+        return type(e).__name__, str(e)
+    return None
+
+def _rebuild_error(name, message):
+    """
+    Create the exception reported by :func:`_load_many_worker`.
+
+    Builtin exceptions are created with the same type, all others are
+    reported as RuntimeError.
+    """
+    cls = getattr(exceptions, name, None)
+    if isinstance(cls, type) and issubclass(cls, Exception):
+        try:
+            return cls(message)
+        except Exception:
+            pass
+    return RuntimeError("%s: %s" % (name, message))
+
+def load_many(paths, workers=None, **kwargs):
+    """
+    Load several C++QED output files in parallel.
+
+    *Usage*
+        >>> results = load_many(glob.glob("mcwf/*.dat"), workers=4)
+        >>> evs, qs = results[0]
+
+    *Arguments*
+        * *paths*
+            A list of paths to C++QED output files.
+
+        * *workers* (optional)
+            Number of worker processes. If None the number of CPUs is used,
+            if 1 the files are loaded one after another in this process.
+
+        * Any other argument is passed to :func:`load_cppqed`, except
+          *cache*.
+
+    *Returns*
+        * *results*
+            A list with one entry for every path in the same order. The
+            entry is the tuple returned by :func:`load_cppqed` or, if the
+            file couldn't be loaded, the exception which was raised.
+
+    The files are parsed by worker processes which store the resulting
+    arrays in a temporary directory, located in shared memory (/dev/shm)
+    if available. These arrays are then memory mapped by this process, so
+    the data is never pickled or copied between the processes. Every file
+    is parsed only once, even if it is given several times. If a worker
+    couldn't load a file, its exception is rebuilt from the type name and
+    message, exceptions which aren't builtin become RuntimeErrors.
+    """
+    if "cache" in kwargs:
+        raise TypeError("load_many() doesn't support the 'cache' argument.")
+    arguments = inspect.getargspec(load_cppqed)[0]
+    for name in kwargs:
+        if name not in arguments:
+            raise TypeError("load_many() got an unexpected keyword argument "
+                            "'%s'" % name)
+    paths = list(paths)
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = min(workers, len(paths))
+    results = [None]*len(paths)
+    if workers <= 1:
+        for i, path in enumerate(paths):
+            try:
+                results[i] = load_cppqed(path, **kwargs)
+            except Exception, e:
+                results[i] = e
+        return results
+    if os.path.isdir("/dev/shm"):
+        tmpdir = "/dev/shm"
     else:
-        start = 0
-        _systems = desc.quantumsystem.subsystems
-        length = len(_systems)
-        for i, subs in enumerate(desc.expvalues.subsystems):
-            titles.extend(subs.entrys.values())
-            end = len(titles)
-            if 0<i<=length:
-                subsystems["(%s)%s" % (i-1, _systems[i-1].__name__)] = (start, end)
-            start = end
-        qs = quantumsystem.QuantumSystemCompound(svstraj, *_systems)
-    evstraj = expvalues.ExpectationValueCollection(evs, time=time,
-                            titles=titles, subsystems=subsystems, copy=False)
-    return evstraj, qs
+        tmpdir = None
+    cachedir = tempfile.mkdtemp(prefix="pycppqed_many_", dir=tmpdir)
+    try:
+        # Workers loading the same file would write the same cache.
+        unique = []
+        for path in paths:
+            if path not in unique:
+                unique.append(path)
+        pool = multiprocessing.Pool(workers)
+        try:
+            errors = pool.map(_load_many_worker,
+                              [(path, cachedir, kwargs) for path in unique], 1)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+        errors = dict(zip(unique, errors))
+        for i, path in enumerate(paths):
+            if errors[path] is not None:
+                results[i] = _rebuild_error(*errors[path])
+                continue
+            try:
+                results[i] = load_cppqed(path, cache=cachedir, **kwargs)
+            except Exception, e:
+                results[i] = e
+    finally:
+        # The memory mapped arrays stay valid after their files are removed.
+        shutil.rmtree(cachedir, ignore_errors=True)
+    return results
+
+def _parse_expvalue_rows(evs, evsstr):
+    """
+    Parse a block of expectation value rows and append them to evs.
+
+    *Arguments*
+        * *evs*
+            An :class:`_ArrayStack` holding the rows parsed so far.
+
+        * *evsstr*
+            A string with one or more rows of expectation values.
+
+    All numbers of the block are parsed at once. Only if the rows don't have
+    the same number of columns they are parsed row by row.
+    """
+    evsstr = evsstr.strip()
+    if len(evs):
+        ncols = evs.buffer.shape[1]
+    else:
+        ncols = len(evsstr.split("\n", 1)[0].split())
+    nrows = evsstr.count("\n") + 1
+    data = numpy.fromstring(evsstr, dtype=float, sep=" ")
+    if data.size == nrows*ncols:
+        evs.extend(data.reshape((nrows, ncols)))
+    else:
+        for line in evsstr.splitlines():
+            if line and not line.isspace():
+                ev = numpy.fromstring(line, dtype=float, sep=" ")
+                if ev.size != ncols:
+                    raise ValueError("Expected %s expectation values "
+                                     "instead of %s." % (ncols, ev.size))
+                evs.append(ev)
+
+def load_expvalues(filename, subsystems=None):
+    """
+    Load only the expectation values of a C++QED output file.
+
+    *Usage*
+        >>> evs = load_expvalues("ring.dat")
+
+    *Arguments*
+        * *filename*
+            Path to the C++QED output file that should be loaded. The file
+            may be compressed with gzip, bzip2 or xz.
+
+        * *subsystems* (optional)
+            Only return the expectation values of the given subsystems, see
+            :func:`load_cppqed`.
+
+    *Returns*
+        * *evs*
+            A :class:`pycppqed.expvalues.ExpectationValueCollection` holding
+            all expectation values, the same as returned by
+            :func:`load_cppqed`.
+
+    The state vectors in the file are skipped without being parsed and
+    the rows of expectation values between them are parsed in bulk.
+    """
+    evs = _ArrayStack(float)
+    buf = _open_mapped(filename)
+    if buf is not None:
+        try:
+            records = _iter_mapped_cppqed_output(buf, offsets=True,
+                                                 evblocks=True)
+            kind, commentstr = records.next()
+            for kind, data in records:
+                if kind == "evs":
+                    _parse_expvalue_rows(evs, data)
+        finally:
+            buf.close()
+    else:
+        f = _open_cppqed(filename)
+        try:
+            rows = []
+            records = _iter_cppqed_output(f, skip_sv=lambda: True)
+            kind, commentstr = records.next()
+            for kind, data in records:
+                if kind == "ev":
+                    rows.append(data)
+                    if len(rows) == 4096:
+                        _parse_expvalue_rows(evs, "\n".join(rows))
+                        rows = []
+            if rows:
+                _parse_expvalue_rows(evs, "\n".join(rows))
+        finally:
+            f.close()
+    evs = _expvalue_rows(evs.array(), commentstr)
+    if subsystems is None:
+        columns = None
+    else:
+        columns = _expvalue_columns(commentstr, subsystems)
+        evs = evs[columns]
+    evstraj, _systems = _build_expvalues(commentstr, evs, columns)
+    return evstraj
+
+class LazyStateVectorTrajectory:
+    """
+    A trajectory of state vectors which are only parsed when accessed.
+
+    *Usage*
+        >>> svs = LazyStateVectorTrajectory("ring.dat")
+        >>> print len(svs)
+        9
+        >>> sv = svs[3]
+        >>> sv = svs.at(2.5)
+        >>> svtraj = svs[::2].load()
+
+    *Arguments*
+        * *filename*
+            Path to the C++QED output file.
 
-def load_statevector(filename):
+        * *cachesize* (optional)
+            Number of recently accessed StateVectors that are kept in memory.
+            (Default is 8)
+
+    On creation the file is memory mapped and scanned once for the positions
+    of all state vectors and their times, which are taken from the preceding
+    row of expectation values. Indexing with an integer returns a
+    :class:`pycppqed.statevector.StateVector`, slicing returns another
+    LazyStateVectorTrajectory sharing file and cache. Compressed files can't
+    be mapped, for them a ValueError is raised; use :func:`load_cppqed`
+    instead.
+    """
+    def __init__(self, filename, cachesize=8):
+        if _compression(filename) is not None:
+            raise ValueError("Compressed file '%s' can't be loaded lazily."
+                             % filename)
+        self.filename = filename
+        self._map = buf = _open_mapped(filename)
+        starts = []
+        ends = []
+        time = []
+        svbases = []
+        bases = []
+        evstr = None
+        if buf is not None:
+            records = _iter_mapped_cppqed_output(buf, offsets=True)
+            records.next()
+            for kind, data in records:
+                if kind == "ev":
+                    evstr = data
+                elif kind == "sv":
+                    starts.append(data[0])
+                    ends.append(data[1])
+                    time.append(float(evstr.split(None, 1)[0]))
+                    svbases.append(len(bases) - 1)
+                else:
+                    bases.append(data)
+        self._starts = numpy.array(starts, dtype=int)
+        self._ends = numpy.array(ends, dtype=int)
+        self._svbases = numpy.array(svbases, dtype=int)
+        self._bases = bases
+        self._basisobjects = {}
+        self._ids = numpy.arange(len(starts))
+        self._cache = utils.LRUCache(cachesize)
+        self.time = numpy.array(time, dtype=float)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            view = copy.copy(self)
+            view._starts = self._starts[index]
+            view._ends = self._ends[index]
+            view._svbases = self._svbases[index]
+            view._ids = self._ids[index]
+            view.time = self.time[index]
+            return view
+        length = len(self)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError("StateVector index out of range.")
+        key = self._ids[index]
+        try:
+            return self._cache[key]
+        except KeyError:
+            sv = self._parse(index)
+            self._cache[key] = sv
+            return sv
+
+    def __str__(self):
+        clsname = self.__class__.__name__
+        if len(self):
+            dims = " x ".join(map(str, self[0].dimensions))
+        else:
+            dims = ""
+        return "%s(%s x (%s))" % (clsname, len(self), dims)
+
+    def _basis(self, index):
+        """
+        Return the basis object with the given index.
+        """
+        if index < 0:
+            return None
+        if index not in self._basisobjects:
+            name, (start, end) = self._bases[index]
+            states = _blitz2numpy(buffer(self._map, start, end-start))
+            BASES = pycppqed.BASES
+            if name in BASES:
+                states = BASES[name](states)
+            self._basisobjects[index] = states
+        return self._basisobjects[index]
+
+    def _parse(self, index):
+        """
+        Parse the StateVector with the given index from the file.
+        """
+        start = self._starts[index]
+        ba = _blitz2numpy(buffer(self._map, start, self._ends[index]-start))
+        return statevector.StateVector(ba, self.time[index],
+                                       basis=self._basis(self._svbases[index]))
+
+    def index(self, time):
+        """
+        Return the index of the StateVector which is closest to the given time.
+        """
+        if not len(self):
+            raise IndexError("Trajectory is empty.")
+        return int(numpy.abs(self.time - time).argmin())
+
+    def at(self, time):
+        """
+        Return the StateVector which is closest to the given time.
+        """
+        return self[self.index(time)]
+
+    def load(self):
+        """
+        Parse all StateVectors into a StateVectorTrajectory.
+
+        *Returns*
+            * *svtraj*
+                A :class:`pycppqed.statevector.StateVectorTrajectory`.
+        """
+        if not len(self):
+            return statevector.StateVectorTrajectory([])
+        first = self[0]
+        svs = numpy.empty((len(self),) + first.shape, dtype=first.dtype)
+        bases = [None]*len(self)
+        for i in xrange(len(self)):
+            key = self._ids[i]
+            if key in self._cache:
+                svs[i] = self._cache[key]
+            else:
+                start = self._starts[i]
+                svs[i] = _blitz2numpy(buffer(self._map, start,
+                                             self._ends[i]-start))
+            bases[i] = self._basis(self._svbases[i])
+        return statevector.StateVectorTrajectory(svs, time=self.time,
+                                        bases=bases, copy=False)
+
+    def clear(self):
+        """
+        Remove all StateVectors from the cache.
+        """
+        self._cache.clear()
+
+class CppqedFollower:
+    """
+    Incrementally read a C++QED output file which is still being written.
+
+    *Usage*
+        >>> follower = CppqedFollower("ring.dat")
+        >>> if follower.poll():
+        ...     evs, qs = follower.evs, follower.qs
+
+    *Arguments*
+        * *filename*
+            Path to the C++QED output file that should be followed.
+
+    Every call of :meth:`poll` continues reading at the position where the
+    last call stopped, so only new expectation value rows and state vectors
+    are parsed. A record which is not yet completely written is left for the
+    next call. The collected data is stored in growing buffers and the
+    attributes :attr:`evs` (an
+    :class:`pycppqed.expvalues.ExpectationValueCollection`) and :attr:`qs`
+    (a :class:`pycppqed.quantumsystem.QuantumSystem`) are views on them,
+    just like the return values of :func:`load_cppqed`. They are rebuilt
+    without copying the buffers and the basis objects are only created for
+    new records, so a poll costs time proportional to the new data.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.position = 0
+        self.evs = None
+        self.qs = None
+        self._collector = _CppqedCollector()
+        self._basisobjects = [] # Basis objects of all found bases
+        self._svbasisobjects = [] # Basis object of every state vector
+
+    def poll(self):
+        """
+        Read everything that was appended to the file since the last call.
+
+        *Returns*
+            * *new*
+                True if new expectation values or state vectors were found.
+        """
+        c = self._collector
+        handlers = {
+            "ev": c.ev_handler,
+            "sv": c.sv_handler,
+            "basis": lambda data:c.basis_handler(*data),
+            }
+        new = False
+        f = open(self.filename)
+        try:
+            f.seek(self.position)
+            records = _iter_cppqed_output(f, comment=self.position==0,
+                                          follow=True)
+            for kind, data in records:
+                if kind == "comment":
+                    c.comment_handler(data)
+                    continue
+                handlers[kind](data)
+                self.position = f.tell()
+                new = True
+        finally:
+            f.close()
+        if new and len(c.evs):
+            for basis in c.bases[len(self._basisobjects):]:
+                self._basisobjects.append(_basis_object(*basis))
+            svbases = c.svbases.view()
+            for i in svbases[len(self._svbasisobjects):]:
+                if i >= 0:
+                    self._svbasisobjects.append(self._basisobjects[i])
+                else:
+                    self._svbasisobjects.append(None)
+            self.evs, self.qs = _build_cppqed(svbasisobjects=
+                            self._svbasisobjects[:], *c.data(view=True))
+        return new
+
+def load_statevector(filename, dtype=None):
     """
     Load a C++QED state vector file from the given location.
 
@@ -226,23 +1716,118 @@ def load_statevector(filename):
     *Arguments*
         * *filename*
             Path to the C++QED state vector file that should be loaded.
+            The file may be compressed with gzip, bzip2 or xz.
+
+        * *dtype* (optional)
+            Precision in which the state vector is stored, see
+            :func:`load_cppqed`. (Default is None which means double
+            precision)
 
     *Returns*
         * *sv*
             A :class:`pycppqed.statevector.StateVector` instance.
     """
-    f = open(filename)
-    buf = f.read()
-    f.close()
+    time, datastr = _read_statevector(filename)
+    ba = _blitz2numpy(datastr, _dtypes(dtype)[1])
+    return statevector.StateVector(ba, time, copy=False)
+
+def _read_statevector(filename):
+    """
+    Read a C++QED state vector file.
+
+    Returns a tuple ``(time, blitzstr)``. If the file has no header line
+    with the time, *time* is None.
+    """
+    f = _open_cppqed(filename)
+    try:
+        buf = f.read()
+    finally:
+        f.close()
     if buf.startswith("# "): # Syntax of old statevector files.
         commentstr, datastr = buf.split("\n", 1)
     else:
         datastr, commentstr = buf.rstrip(" \n\t").rsplit("\n", 1)
+        if commentstr.endswith("]"): # Written by split_cppqed without header.
+            return None, buf
         if not commentstr.startswith("# "):
             raise ValueError("Not a valid statevector file.")
     time = commentstr[2:commentstr.find(" ", 3)]
-    ba = _blitz2numpy(datastr)
-    return statevector.StateVector(ba, float(time))
+    return float(time), datastr
+
+def load_statevectors(path, workers=None, dtype=None):
+    """
+    Load the state vectors written by :func:`split_cppqed`.
+
+    *Usage*
+        >>> split_cppqed("ring.dat", "split/r.dat")
+        >>> svt = load_statevectors("split/r.dat")
+
+    *Arguments*
+        * *path*
+            The *writepath* that was given to :func:`split_cppqed`. All
+            files ``{path}_{time}.sv`` are loaded, basis files are ignored.
+
+        * *workers* (optional)
+            Number of threads parsing the files. If None or 1 the files are
+            parsed one after another.
+
+        * *dtype* (optional)
+            Precision in which the state vectors are stored, see
+            :func:`load_cppqed`. (Default is None which means double
+            precision)
+
+    *Returns*
+        * *svt*
+            A :class:`pycppqed.statevector.StateVectorTrajectory` with the
+            state vectors sorted by time.
+
+    One array for all state vectors is allocated at the beginning and every
+    file is parsed directly into its part of this array. The C extension
+    releases the GIL while parsing, so threads run in parallel.
+    """
+    pattern = re.compile(re.escape(path) +
+                         r"_(-?[0-9.]+(?:e[-+]?[0-9]+)?)\.sv$")
+    entries = []
+    for name in glob.glob("%s_*.sv" % path):
+        match = pattern.match(name)
+        if match is not None:
+            entries.append((float(match.group(1)), name))
+    if not entries:
+        raise ValueError("No state vector files found for '%s'." % path)
+    entries.sort()
+    for (t1, name1), (t2, name2) in zip(entries[:-1], entries[1:]):
+        if t1 == t2:
+            raise ValueError("State vector files '%s' and '%s' have the same "
+                             "time." % (name1, name2))
+    names = [name for t, name in entries]
+    time = numpy.array([t for t, name in entries])
+    first = _read_statevector(names[0])
+    dims = _blitz_dims(_split_blitz(first[1])[0])
+    svs = numpy.empty((len(names),) + dims, dtype=_dtypes(dtype)[1])
+    flat = svs.reshape(len(names), -1)
+    def parse(i):
+        if i == 0:
+            t, blitzstr = first
+        else:
+            t, blitzstr = _read_statevector(names[i])
+        dimstr, datastr = _split_blitz(blitzstr)
+        if _blitz_dims(dimstr) != dims:
+            raise ValueError("State vector in '%s' has dimensions %s "
+                             "instead of %s." % (names[i], dimstr, dims))
+        if t is not None:
+            time[i] = t
+        _parse_blitz_into(datastr, flat[i])
+    if workers is None or workers <= 1:
+        for i in range(len(names)):
+            parse(i)
+    else:
+        pool = multiprocessing.pool.ThreadPool(workers)
+        try:
+            pool.map(parse, range(len(names)), 1)
+        finally:
+            pool.close()
+            pool.join()
+    return statevector.StateVectorTrajectory(svs, time, copy=False)
 
 def save_statevector(filename, sv):
     """
@@ -259,13 +1844,15 @@ def save_statevector(filename, sv):
         *sv*
             A :class:`pycppqed.statevector.StateVector` instance.
     """
-    isfile = False
     f = open(filename, "w")
-    f.write(_numpy2blitz(sv))
-    f.write("\n# %s 1\n" % sv.time)
-    f.close()
+    try:
+        _write_blitz(f, sv)
+        f.write("\n# %s 1\n" % sv.time)
+    finally:
+        f.close()
 
-def split_cppqed(readpath, writepath, header=True):
+def split_cppqed(readpath, writepath, header=True, mmap=False, tmin=None,
+                 tmax=None, every=None, ev_every=None, sv_every=None):
     """
     Split a C++QED output file into default part and state vectors.
 
@@ -274,7 +1861,8 @@ def split_cppqed(readpath, writepath, header=True):
 
     *Arguments*
         * *readpath*
-            Path to the C++QED output file that should be split up.
+            Path to the C++QED output file that should be split up. The
+            file may be compressed with gzip, bzip2 or xz.
 
         * *writepath*
             Path where the output should be saved to.
@@ -283,16 +1871,29 @@ def split_cppqed(readpath, writepath, header=True):
             If True a header line of the form ``# {time} {next_time_step}``
             is written. (Default is True)
 
+        * *mmap* (optional)
+            If True the C++QED output file is memory mapped and the state
+            vectors are written directly from the map. (Default is False)
+
+        * *tmin*, *tmax*, *every*, *ev_every*, *sv_every* (optional)
+            Select which expectation values and state vectors are written,
+            see :func:`load_cppqed`.
+
     The standard part of the C++QED output file is saved to the given path,
     while the state vectors are saved to the same directory with the
     naming convention ``{path}_{time}.sv``.
     """
     evs = [] # Expectation values
-    def sv_handler(svstr):
+    selection = _selection(tmin, tmax, every, ev_every, sv_every)
+    def time():
+        if selection is not None:
+            return selection.time
         if not evs:
             raise ValueError("Can't find timestamps in given file.")
         ev = evs[-1]
-        t = float(ev[:ev.find(" ")])
+        return float(ev[:ev.find(" ")])
+    def sv_handler(svstr):
+        t = time()
         f = open("%s_%06f.sv" % (writepath, t), "w")
         if header:
             f.write("# %s 1\n" % t)
@@ -300,17 +1901,14 @@ def split_cppqed(readpath, writepath, header=True):
         f.close()
 
     def basis_handler(name, svstr):
-        if not evs:
-            raise ValueError("Can't find timestamps in given file.")
-        ev = evs[-1]
-        t = float(ev[:ev.find(" ")])
+        t = time()
         f = open("%s_%06f_basis.sv" % (writepath, t), "w")
         if header:
             f.write("# %s 1\n" % t)
         f.write(svstr)
         f.close()
     commentstr = _split_cppqed_output(readpath, evs.append, sv_handler,
-                                      basis_handler)
+                                      basis_handler, mmap, selection)
     f = open(writepath, "w")
     f.write(commentstr)
     f.write("\n\n%s\n" % "\n".join(evs) )
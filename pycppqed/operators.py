@@ -0,0 +1,194 @@
+"""
+This module provides compact representations of operators.
+
+The relevant classes are:
+    * :class:`BandedOperator`
+    * :class:`TensorProductOperator`
+
+Instances of these classes can be given to
+:meth:`pycppqed.statevector.StateVector.expvalue` and
+:meth:`pycppqed.statevector.StateVectorTrajectory.expvalue` instead of dense
+arrays. Only their nonzero elements are used, so applying them costs time
+proportional to the number of these elements. The same is true for
+``scipy.sparse`` matrices, which are accepted as well.
+
+Every operator class implements the method ``apply(array)`` which applies
+the operator to the first axis of the given array. :func:`apply_operator`
+does the same for all kinds of operators.
+"""
+
+import numpy
+
+class BandedOperator:
+    """
+    An operator which only has nonzero elements on a few diagonals.
+
+    *Usage*
+        >>> a = BandedOperator({-1: numpy.sqrt(numpy.arange(1, 10))}, 10)
+        >>> print (a.todense() == numpy.diag(numpy.sqrt(numpy.arange(1, 10)), -1)).all()
+        True
+
+    *Arguments*
+        * *diagonals*
+            A dictionary mapping the offset of every nonzero diagonal to its
+            elements. The offsets have the same meaning as in
+            :func:`numpy.diag`, positive offsets are above the main diagonal.
+            Instead of an array also a single number can be given for
+            diagonals with constant elements.
+
+        * *dim*
+            The dimension of the space the operator acts on.
+    """
+    def __init__(self, diagonals, dim):
+        self.dim = dim
+        self.shape = (dim, dim)
+        self.diagonals = {}
+        for offset, values in diagonals.items():
+            length = dim - abs(offset)
+            if length <= 0:
+                raise ValueError("Offset %s is too large for dimension %s."
+                                 % (offset, dim))
+            values = numpy.asarray(values)
+            if values.ndim == 0:
+                values = values*numpy.ones(length)
+            elif values.shape != (length,):
+                raise ValueError("Diagonal %s needs %s elements instead of %s."
+                                 % (offset, length, len(values)))
+            self.diagonals[offset] = values
+
+    def __str__(self):
+        clsname = self.__class__.__name__
+        offsets = ", ".join(map(str, sorted(self.diagonals)))
+        return "%s(%s, offsets=(%s))" % (clsname, self.dim, offsets)
+
+    def apply(self, array):
+        """
+        Apply the operator to the first axis of the given array.
+        """
+        array = numpy.asarray(array)
+        if array.shape[0] != self.dim:
+            raise ValueError("Operator of dimension %s can't be applied to "
+                             "axis of length %s." % (self.dim, array.shape[0]))
+        dtype = numpy.result_type(array, *self.diagonals.values())
+        result = numpy.zeros(array.shape, dtype=dtype)
+        shape = (-1,) + (1,)*(array.ndim-1)
+        for offset, values in self.diagonals.items():
+            values = values.reshape(shape)
+            length = len(values)
+            if offset >= 0:
+                result[:length] += values*array[offset:]
+            else:
+                result[-offset:] += values*array[:length]
+        return result
+
+    def todense(self):
+        """
+        Return the operator as dense 2D array.
+        """
+        dtype = numpy.result_type(float, *self.diagonals.values())
+        result = numpy.zeros(self.shape, dtype=dtype)
+        for offset, values in self.diagonals.items():
+            result += numpy.diag(values, offset)
+        return result
+
+    def transpose(self):
+        """
+        Return the transposed operator.
+        """
+        return BandedOperator(dict((-offset, values) for offset, values
+                                   in self.diagonals.items()), self.dim)
+
+    def conjugate(self):
+        """
+        Return the complex conjugated operator.
+        """
+        return BandedOperator(dict((offset, values.conjugate()) for
+                                   offset, values in self.diagonals.items()),
+                              self.dim)
+
+
+class TensorProductOperator:
+    """
+    A tensor product of operators acting on single subsystems.
+
+    *Usage*
+        >>> a = BandedOperator({-1: numpy.sqrt(numpy.arange(1, 10))}, 10)
+        >>> op = TensorProductOperator({1: a, 3: a.transpose()})
+        >>> ev = sv.expvalue(op)
+
+    *Arguments*
+        * *factors*
+            A dictionary mapping the number of a subsystem to the operator
+            acting on it. The operators can be dense 2D arrays, compact
+            operators like :class:`BandedOperator` or ``scipy.sparse``
+            matrices. On all other subsystems the identity is implied.
+
+    The factors are applied to the StateVector one axis after the other, so
+    neither the full operator nor a reduced Psi-square tensor is built.
+    """
+    def __init__(self, factors):
+        self.factors = {}
+        for number, op in factors.items():
+            if number < 0:
+                raise ValueError("Subsystem numbers can't be negative.")
+            if not (hasattr(op, "apply") or hasattr(op, "tocsr")):
+                op = numpy.asarray(op)
+            self.factors[number] = op
+
+    def __str__(self):
+        clsname = self.__class__.__name__
+        return "%s(%s)" % (clsname, ", ".join(map(str, sorted(self.factors))))
+
+    def apply(self, array, offset=0):
+        """
+        Apply the operator to the given array.
+
+        *Arguments*
+            * *array*
+                The array the operator is applied to.
+
+            * *offset* (optional)
+                The axis ``offset+i`` of the array belongs to subsystem i.
+                E.g. an offset of 1 is used for a trajectory of state vectors.
+        """
+        for number, op in sorted(self.factors.items()):
+            axis = offset + number
+            if axis >= array.ndim:
+                raise ValueError("Array has no axis for subsystem %s."
+                                 % number)
+            result = apply_operator(op, numpy.rollaxis(array, axis))
+            array = numpy.rollaxis(result, 0, axis+1)
+        return array
+
+    def todense(self, dimensions):
+        """
+        Return the operator as dense tensor for the given dimensions.
+
+        The returned tensor has the index order expected by
+        :meth:`pycppqed.statevector.StateVector.expvalue`, i.e.
+        ``(r1, c1, r2, c2, ..)``.
+        """
+        result = numpy.ones(())
+        for number, dim in enumerate(dimensions):
+            op = self.factors.get(number)
+            if op is None:
+                op = numpy.eye(dim)
+            elif hasattr(op, "todense"):
+                op = numpy.asarray(op.todense())
+            result = numpy.multiply.outer(result, op)
+        return result
+
+
+def apply_operator(op, array):
+    """
+    Apply a dense, compact or sparse operator to the first axis of the array.
+    """
+    if hasattr(op, "apply"):
+        return op.apply(array)
+    if op.shape[1] != array.shape[0]:
+        raise ValueError("Operator of shape %s can't be applied to axis of "
+                         "length %s." % (op.shape, array.shape[0]))
+    if hasattr(op, "tocsr"):
+        result = op.dot(array.reshape(array.shape[0], -1))
+        return numpy.asarray(result).reshape((op.shape[0],)+array.shape[1:])
+    return numpy.tensordot(op, array, (1, 0))
@@ -12,8 +12,10 @@ All classes in this module inherit from :class:`QuantumSystem`.
 
 # TODO: Improve quantumsystem.py
 """
+import multiprocessing.pool
 import numpy
 import expvalues
+import statevector
 import animation
 import utils
 
@@ -30,11 +32,17 @@ class QuantumSystem:
         dims = self.statevector.dimensions[self.number]
         return "%s(%s)" % (clsname, dims)
 
-    def expvalues(self):
+    def expvalues(self, chunksize=None):
         """
         Calculate the default expectation values for this system.
 
         This method has to be overridden in all inheriting classes.
+
+        *Arguments*
+            * *chunksize* (optional)
+                Number of points of time which are processed at once. Systems
+                which calculate their expectation values state vector by
+                state vector ignore it.
         """
         raise NotImplementedError
 
@@ -77,7 +85,7 @@ class QuantumSystemCompound(QuantumSystem):
             else:
                 raise ValueError("Argument has to be a System class.")
 
-    def expvalues(self, subsystems=None):
+    def expvalues(self, subsystems=None, chunksize=None):
         """
         Calculate the default expectation values for this system.
 
@@ -87,19 +95,33 @@ class QuantumSystemCompound(QuantumSystem):
                 expectation values should be calculated.
                 (Default is None which means all subsystems are calculated).
 
+            * *chunksize* (optional)
+                Number of points of time which are processed at once. It is
+                used when the distributions of the subsystems are calculated
+                and passed on to the subsystems which accept it.
+
         *Returns*
             * *expvalues*
                 An :class:`pycppqed.expvalues.ExpectationValuesCollection`.
+
+        The distributions of all subsystems are calculated in one pass over
+        :math:`|\Psi|^2` before the subsystems evaluate their observables
+        with them.
         """
         if subsystems is None:
             subsystems = range(len(self.subsystems))
+        sv = self.statevector
+        if isinstance(sv, statevector.StateVectorTrajectory):
+            sv.cachemarginals(subsystems, chunksize)
+        else:
+            sv.cachemarginals(subsystems)
         evs = []
         titles = []
         subsys = utils.OrderedDict()
         pos_start = 0
         for n, s in enumerate(subsystems):
             sub = self.subsystems[s]
-            ev = sub.expvalues()
+            ev = sub.expvalues(chunksize=chunksize)
             evs.extend(ev.evtrajectories)
             pos_end = len(evs)
             titles.extend(ev.titles)
@@ -117,7 +139,7 @@ class Particle(QuantumSystem):
     """
     A class representing a single particle.
     """
-    def expvalues(self, k=True, x=True):
+    def expvalues(self, k=True, x=True, chunksize=None, workers=None):
         r"""
         Calculate the default expectation values for this particle.
 
@@ -132,42 +154,141 @@ class Particle(QuantumSystem):
                 means :math:`\langle x \rangle` and :math:`\Delta x`.
                 (Default is True)
 
+            * *chunksize*, *workers* (optional)
+                See :meth:`moments`.
+
         *Returns*
             * *expvalues*
                 A :class:`pycppqed.expvalues.ExpectationValuesCollection`.
         """
-        number = self.number
         sv = self.statevector
         evs = []
         titles = []
-        k_dim = self.statevector.dimensions[number]
+        k_moments, x_moments = self.moments((1, 2), k, x, chunksize, workers)
         if k:
-            K = numpy.arange(-k_dim/2, k_dim/2)
-            ev = sv.diagexpvalue((K, K**2), indices=number, multi=True)
-            ev_k = ev[0]
-            var_k = ev[1] - ev_k**2
+            ev_k = k_moments[0]
+            var_k = k_moments[1] - ev_k**2
             evs.append(ev_k)
             titles.append("<k>")
             evs.append(var_k)
             titles.append("Var(k)")
         if x:
-            sv_x = sv.fft(number)
-            X = numpy.linspace(-numpy.pi, numpy.pi, k_dim, endpoint=False)
-            ev = sv_x.diagexpvalue((X, X**2), indices=number, multi=True)
-            ev_x = ev[0]*2*numpy.pi/k_dim
-            std_x = numpy.sqrt(ev[1]*2*numpy.pi/k_dim - ev_x**2)
+            ev_x = x_moments[0]
+            std_x = numpy.sqrt(x_moments[1] - ev_x**2)
             evs.append(ev_x)
             titles.append("<x>")
             evs.append(std_x)
             titles.append("Std(x)")
         return expvalues.ExpectationValueCollection(evs, sv.time, titles)
 
+    def moments(self, powers=(1, 2), k=True, x=True, chunksize=None,
+                workers=None):
+        r"""
+        Calculate the moments of momentum and position of this particle.
+
+        *Usage*
+            >>> k_moments, x_moments = Particle(sv).moments((1, 2, 3, 4))
+
+        *Arguments*
+            * *powers* (optional)
+                A list of integers j for which :math:`\langle k^j \rangle`
+                and :math:`\langle x^j \rangle` are calculated.
+                (Default is (1, 2))
+
+            * *k*, *x* (optional)
+                Specify if the momentum and the position moments are
+                calculated. (Default is True)
+
+            * *chunksize* (optional)
+                Number of points of time which are Fourier transformed at
+                once.
+
+            * *workers* (optional)
+                Number of threads transforming the chunks. If None or 1 the
+                chunks are transformed one after another.
+
+        *Returns*
+            * *k_moments*, *x_moments*
+                Real arrays with one row for every power or None if they are
+                not calculated. For a StateVectorTrajectory every row holds
+                one value per point of time.
+
+        The momentum moments are taken from the cached distribution of the
+        particle. For the position moments every chunk is transformed with
+        one FFT along the axis of the particle and reduced to its position
+        distribution right away, so no transformed trajectory is built.
+        Since only :math:`|\Psi(x)|^2` is needed, the shifts of the FFT
+        are applied to the cached position grid instead of the data.
+        """
+        sv = self.statevector
+        single = not isinstance(sv, statevector.StateVectorTrajectory)
+        if single:
+            svs = sv[numpy.newaxis]
+        else:
+            svs = sv
+        axis = self.number + 1
+        dim = svs.shape[axis]
+        K, X = _particle_grids(dim)
+        k_moments = x_moments = None
+        if k:
+            if single:
+                p = sv.marginal(self.number)[numpy.newaxis]
+            else:
+                p = sv.marginals(self.number, chunksize)
+            k_moments = numpy.array([numpy.dot(p, K**j) for j in powers])
+        if x:
+            X_powers = numpy.array([X**j for j in powers])
+            x_moments = numpy.empty((len(powers), svs.shape[0]))
+            def transform(chunk):
+                psi = numpy.fft.ifft(numpy.asarray(svs[chunk]), axis=axis)
+                p = psi.real**2 + psi.imag**2
+                others = tuple([i for i in range(1, p.ndim) if i != axis])
+                if others:
+                    p = p.sum(axis=others)
+                x_moments[:, chunk] = numpy.dot(X_powers, p.T)*dim
+            if workers is None or workers <= 1:
+                for chunk in statevector._chunks(svs, chunksize):
+                    transform(chunk)
+            else:
+                chunks = list(statevector._chunks(svs, chunksize))
+                if chunksize is None and len(chunks) < workers:
+                    chunksize = max(1, -(-svs.shape[0]//workers))
+                    chunks = list(statevector._chunks(svs, chunksize))
+                pool = multiprocessing.pool.ThreadPool(workers)
+                try:
+                    pool.map(transform, chunks, 1)
+                finally:
+                    pool.close()
+                    pool.join()
+        if single:
+            if k:
+                k_moments = k_moments[:,0]
+            if x:
+                x_moments = x_moments[:,0]
+        return k_moments, x_moments
+
+
+# Momentum grid and position grid (in FFT order) for every dimension.
+_PARTICLE_GRIDS = {}
+
+def _particle_grids(dim):
+    """
+    Return the momentum grid and the position grid of a particle.
+
+    The position grid is in the order of the unshifted inverse FFT.
+    """
+    if dim not in _PARTICLE_GRIDS:
+        K = numpy.arange(-dim/2, dim/2)
+        X = numpy.linspace(-numpy.pi, numpy.pi, dim, endpoint=False)
+        _PARTICLE_GRIDS[dim] = K, numpy.fft.ifftshift(X)
+    return _PARTICLE_GRIDS[dim]
+
 
 class Mode(QuantumSystem):
     """
     A class representing a single mode.
     """
-    def expvalues(self, n=True, a=True):
+    def expvalues(self, n=True, a=True, chunksize=None):
         r"""
         Calculate the default expectation values for this particle.
 
@@ -182,6 +303,9 @@ class Mode(QuantumSystem):
                 means :math:`Re(\langle a \rangle)` and
                 :math:`Im(\langle a \rangle)`. (Default is True)
 
+            * *chunksize* (optional)
+                Number of points of time which are processed at once.
+
         *Returns*
             * *expvalues*
                 A :class:`pycppqed.expvalues.ExpectationValuesCollection`.
@@ -201,20 +325,84 @@ class Mode(QuantumSystem):
             evs.append(var_n)
             titles.append("Var(n)")
         if a:
-            m_a = numpy.diag(numpy.sqrt(numpy.arange(1, m_dim)), -1)
-            ev_a = sv.expvalue(m_a, indices=number)
+            ev_a = self.moments((1,), chunksize)[0]
             evs.append(ev_a.real)
             titles.append("Re(<a>)")
             evs.append(ev_a.imag)
             titles.append("Im(<a>)")
         return expvalues.ExpectationValueCollection(evs, sv.time, titles)
 
+    def moments(self, powers=(1, 2), chunksize=None):
+        r"""
+        Calculate the expectation values of powers of the annihilation operator.
+
+        *Usage*
+            >>> a, a2 = Mode(sv).moments((1, 2))
+
+        *Arguments*
+            * *powers* (optional)
+                A list of integers k for which :math:`\langle a^k \rangle`
+                is calculated. (Default is (1, 2))
+
+            * *chunksize* (optional)
+                Number of points of time which are processed at once.
+
+        *Returns*
+            * *moments*
+                A complex array with one row for every power. For a
+                StateVectorTrajectory every row holds one value per point
+                of time.
+
+        :math:`\langle a^k \rangle = \sum_n \sqrt{n!/(n-k)!}\,
+        \Psi^*_{n-k} \Psi_n` is calculated from two shifted slices of the
+        state along the axis of this mode, so no operator is built.
+        """
+        sv = self.statevector
+        if isinstance(sv, statevector.StateVectorTrajectory):
+            svs = sv
+        else:
+            svs = sv[numpy.newaxis]
+        axis = self.number + 1
+        dim = svs.shape[axis]
+        result = numpy.zeros((len(powers), svs.shape[0]), dtype=complex)
+        for chunk in statevector._chunks(svs, chunksize):
+            psi = numpy.rollaxis(statevector._double(numpy.asarray(svs[chunk])),
+                                 axis, 1)
+            psi_c = psi.conjugate()
+            for i, k in enumerate(powers):
+                if k >= dim:
+                    continue
+                weights = _ladder_weights(dim, k)
+                weights = weights.reshape((-1,) + (1,)*(psi.ndim-2))
+                ev = psi_c[:,:dim-k]*weights*psi[:,k:]
+                result[i, chunk] = ev.sum(axis=tuple(range(1, ev.ndim)))
+        if svs is sv:
+            return result
+        return result[:,0]
+
+
+# Weights of the powers of the annihilation operator for every dimension.
+_LADDER_WEIGHTS = {}
+
+def _ladder_weights(dim, power):
+    r"""
+    Return :math:`\sqrt{n!/(n-k)!}` for :math:`n = k, .., dim-1`.
+    """
+    key = (dim, power)
+    if key not in _LADDER_WEIGHTS:
+        n = numpy.arange(power, dim)
+        weights = numpy.ones(dim - power)
+        for j in range(power):
+            weights *= numpy.sqrt(n - j)
+        _LADDER_WEIGHTS[key] = weights
+    return _LADDER_WEIGHTS[key]
+
 
 class CoherentMode(QuantumSystem):
     """
     A class representing a single mode in a coherent basis.
     """
-    def expvalues(self, n=True, a=True):
+    def expvalues(self, n=True, a=True, chunksize=None):
         number = self.number
         sv = self.statevector
         evs = []
@@ -247,7 +435,7 @@ class QBit(QuantumSystem):
     """
     A class representing a single qubit.
     """
-    def expvalues(self):
+    def expvalues(self, chunksize=None):
         # TODO: implement standard expvalues for QBit.
         return []
 
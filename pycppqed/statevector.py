@@ -12,13 +12,62 @@ points of time.
 
 import numpy
 import expvalues
+import utils
 import visualization
+from operators import apply_operator
 try:
     set()
 except NameError:
     from sets import Set as set
 
-class StateVector(numpy.ndarray):
+# Maximal number of bytes of reduced Psi-square tensors and marginal
+# distributions which are cached for every StateVector and
+# StateVectorTrajectory. The StateVectors of a trajectory share the cache
+# of the trajectory.
+REDUCTION_CACHEBYTES = 1<<26
+
+class _ReductionCache(object):
+    """
+    Mixin which forgets cached reductions when the array is changed in place.
+
+    Only changes through the array itself are noticed, i.e. in-place
+    arithmetic and item assignment. Changes through other views of the same
+    data are not, in this case :meth:`clear_cache` has to be called.
+    """
+    def __setitem__(self, index, value):
+        _clear_cache(self)
+        numpy.ndarray.__setitem__(self, index, value)
+
+    def __setslice__(self, start, stop, value):
+        _clear_cache(self)
+        numpy.ndarray.__setslice__(self, start, stop, value)
+
+    def __iadd__(self, other):
+        _clear_cache(self)
+        return numpy.ndarray.__iadd__(self, other)
+
+    def __isub__(self, other):
+        _clear_cache(self)
+        return numpy.ndarray.__isub__(self, other)
+
+    def __imul__(self, other):
+        _clear_cache(self)
+        return numpy.ndarray.__imul__(self, other)
+
+    def __idiv__(self, other):
+        _clear_cache(self)
+        return numpy.ndarray.__idiv__(self, other)
+
+    def __itruediv__(self, other):
+        _clear_cache(self)
+        return numpy.ndarray.__itruediv__(self, other)
+
+    def __ipow__(self, other):
+        _clear_cache(self)
+        return numpy.ndarray.__ipow__(self, other)
+
+
+class StateVector(_ReductionCache, numpy.ndarray):
     r"""
     A class representing a quantum mechanical state vector in a specific basis.
 
@@ -194,12 +243,77 @@ class StateVector(numpy.ndarray):
 
         This quantity is useful to calculate expectation values in the
         corresponding subspaces.
+
+        The result is calculated in double precision. It is cached, a copy
+        of it is returned, see :meth:`clear_cache`.
         """
         if isinstance(indices, int):
             a = (indices,)
         else:
             a = _sorted_list(indices, True)
-        return numpy.tensordot(self, self.conjugate(), (a,a))
+        kept = tuple([i for i in range(self.ndim) if i not in a])
+        def reducesquare():
+            sv = _double(self)
+            return numpy.tensordot(sv, sv.conjugate(), (a,a))
+        return _cached(self, ("square", kept), reducesquare).copy()
+
+    def marginal(self, indices=None):
+        r"""
+        Return the probability distribution of the given subsystems.
+
+        *Usage*
+            >>> sv = StateVector((1,2,3), norm=True)^StateVector((1,1))
+            >>> print sv.marginal(0)
+            [ 0.07142857  0.28571429  0.64285714]
+
+        *Arguments*
+            * *indices* (optional)
+                An integer or a list of integers specifying which subsystems
+                are kept. (Default is None which means all)
+
+        This is the diagonal of the reduced density matrix, i.e.
+        :math:`|\Psi|^2` summed over all other subsystems. The result is
+        calculated in double precision. It is cached, a copy of it is
+        returned, see :meth:`clear_cache`.
+        """
+        return self._marginal(indices).copy()
+
+    def _marginal(self, indices=None):
+        """
+        Return the cached distribution of the given subsystems.
+        """
+        kept, summed = _kept_axes(self.ndim, indices)
+        return _cached(self, ("marginal", tuple(kept)),
+                       lambda:_marginals(self[numpy.newaxis], kept, summed)[0])
+
+    def cachemarginals(self, numbers=None):
+        """
+        Calculate and cache the distributions of several single subsystems.
+
+        *Arguments*
+            * *numbers* (optional)
+                A list of integers specifying the subsystems.
+                (Default is None which means all)
+
+        :math:`|\Psi|^2` is calculated only once and all distributions are
+        derived from it. Afterwards :meth:`marginal` returns them at once.
+        """
+        for number, p in _single_marginals(self, self[numpy.newaxis], numbers):
+            _cached(self, ("marginal", (number,)), lambda:p[0])
+
+    def clear_cache(self):
+        """
+        Forget all cached reductions of this StateVector.
+
+        Results of :meth:`reducesquare` and :meth:`marginal` are cached, so
+        that expectation values of several operators on the same subsystems
+        need only one reduction. At most :data:`REDUCTION_CACHEBYTES` are
+        kept. In-place arithmetic and item assignment of this StateVector
+        or of the StateVectorTrajectory it belongs to clear the cache
+        automatically, but this method has to be called if the data is
+        changed through any other array.
+        """
+        _clear_cache(self)
 
     def fft(self, axis=0):
         r"""
@@ -238,7 +352,12 @@ class StateVector(numpy.ndarray):
         *Arguments*
             * *operator*
                 A tensor representing an arbitrary operator in the
-                basis of the StateVector.
+                basis of the StateVector. Instead of a dense tensor also a
+                ``scipy.sparse`` matrix or an operator from
+                :mod:`pycppqed.operators` can be given, which act on the
+                flattened indices of the taken subsystems. Only a
+                :class:`pycppqed.operators.TensorProductOperator` specifies
+                its subsystems itself.
 
             * *indices* (optional)
                 Specifies which subsystems should be taken. If None is given
@@ -260,18 +379,27 @@ class StateVector(numpy.ndarray):
         The second sum is exactly what :meth:`reducesquare` does while the
         first expression is the matrix representation of the given operator
         in the same basis as the StateVector.
+
+        Neither :math:`|\Psi \rangle \langle \Psi|` nor the reduced square
+        is built, instead the operator is applied to the StateVector and the
+        scalar product with the result is taken. So besides the operator only
+        memory of the size of the StateVector is needed. Only if the result
+        of :meth:`reducesquare` for the given subsystems is already cached,
+        it is used for dense operators.
         """
+        if not multi:
+            operator = (operator,)
+        squares = None
         if indices is not None:
-            A = self.reducesquare(_conjugate_indices(indices, self.ndim))
-        else:
-            A = self^self.conjugate()
-        length = A.ndim
-        index = range(0, length, 2) + range(1, length, 2)
-        if multi:
-            evs = [(A*op.transpose(index)).sum() for op in operator]
-            return expvalues.ExpectationValueCollection(evs, self.time, title)
-        else:
-            return (A*operator.transpose(index)).sum()
+            kept, summed = _kept_axes(self.ndim, indices)
+            squares = _cached(self, ("square", tuple(kept)))
+            if squares is not None:
+                squares = squares[numpy.newaxis]
+        evs = _expvalues(self[numpy.newaxis], operator, indices,
+                         squares=squares)[:,0]
+        if not multi:
+            return evs[0]
+        return expvalues.ExpectationValueCollection(evs, self.time, title)
 
     def diagexpvalue(self, operator, indices=None, title=None, multi=False):
         r"""
@@ -309,21 +437,16 @@ class StateVector(numpy.ndarray):
 
         Other than the general :meth:`expvalue` method :meth:`diagexpvalue`
         only works for diagonal operators and only needs the diagonal elements
-        of the matrix representation.
+        of the matrix representation. It uses the cached result of
+        :meth:`marginal`.
         """
-        if isinstance(indices, int):
-            indices = (indices,)
-        A = self*self.conjugate()
-        if indices is not None:
-            indices = _sorted_list(_conjugate_indices(indices, self.ndim),
-                                   True)
-            for index in indices:
-                A = A.sum(index)
-        if multi:
-            evs = [(A*op).sum() for op in operator]
-            return expvalues.ExpectationValueCollection(evs, self.time, title)
-        else:
-            return (A*operator).sum()
+        if not multi:
+            operator = (operator,)
+        evs = _diagexpvalues(self._marginal(indices)[numpy.newaxis],
+                             operator)[:,0]
+        if not multi:
+            return evs[0]
+        return expvalues.ExpectationValueCollection(evs, self.time, title)
 
     def outer(self, array):
         r"""
@@ -356,7 +479,7 @@ class StateVector(numpy.ndarray):
     plot = visualization.statevector
 
 
-class StateVectorTrajectory(numpy.ndarray):
+class StateVectorTrajectory(_ReductionCache, numpy.ndarray):
     """
     A class holding StateVectors for different points of time.
 
@@ -378,34 +501,57 @@ class StateVectorTrajectory(numpy.ndarray):
             vector. This array must have as many entries as there are state
             vectors.
 
+        * *bases* (optional)
+            A list which specifies the basis of every state vector. If not
+            given the bases of the single state vectors are used.
+
         * Any other argument that a numpy array takes. E.g. ``copy=False`` can
           be used so that the StateVectorTrajectory shares the data storage
-          with the given numpy array.
+          with the given numpy array and ``dtype=numpy.complex64`` stores the
+          state vectors in single precision.
 
     Most methods are simple mapped to all single StateVectors. For more
     documentation regarding these methods look into the docstrings of the
     corresponding :class:`StateVector` methods.
+
+    A trajectory can be created from one preallocated array without copying
+    it::
+
+        >>> svtraj = StateVectorTrajectory(array, time, copy=False)
+
+    The single StateVectors in :attr:`statevectors` are views into this
+    array which are only created when they are accessed.
     """
-    def __new__(cls, data, time=None, **kwargs):
+    def __new__(cls, data, time=None, bases=None, **kwargs):
         array = numpy.array(data, **kwargs)
         array = array.view(cls)
         if time is None:
             array.time = numpy.array([sv.time for sv in data])
         else:
             array.time = time
-        svs = [None]*array.shape[0]
-        for i, entry in enumerate(array):
-            if hasattr(data[i], "basis"):
-                basis = data[i].basis
+        if bases is None:
+            if isinstance(data, numpy.ndarray):
+                bases = getattr(data, "bases", None)
             else:
-                basis = None
-            svs[i] = StateVector(entry, time=array.time[i], basis=basis, copy=False)
-        array.statevectors = svs
+                bases = [getattr(sv, "basis", None) for sv in data]
+        array.bases = bases
         return array
 
     def __array_finalize__(self, obj):
         self.dimensions = obj.shape[1:]
 
+    def statevectors(self):
+        """
+        Return a sequence of all single StateVectors.
+
+        The StateVectors share the data with the trajectory and are created
+        when they are accessed. They are kept by the trajectory, so the same
+        StateVector (with its cached reductions) is returned every time.
+        """
+        return _StateVectorList(self)
+
+    statevectors = property(statevectors)
+
     def __str__(self):
         clsname = self.__class__.__name__
         dims = " x ".join(map(str, self.dimensions))
@@ -466,43 +612,124 @@ class StateVectorTrajectory(numpy.ndarray):
         """
         return self.map(lambda sv:sv.fft(axis))
 
-    def expvalue(self, operator, indices=None, multi=False, titles=None):
+    def expvalue(self, operator, indices=None, multi=False, titles=None,
+                 chunksize=None):
         """
         Calculate the expectation value of the operator for all StateVectors.
 
+        *Arguments*
+            * *chunksize* (optional)
+                Number of StateVectors which are processed at once. If None
+                it is chosen so that the temporary arrays stay small.
+
         *Returns*
             *evtraj*
                 An :class:`pycppqed.expvalues.ExpectationValuesTrajectory`
                 instance.
 
+        The operator is applied to all StateVectors of a chunk at once with
+        one matrix product. If the result of :meth:`reducesquare` for the
+        given subsystems is cached, it is used instead for dense operators.
         See also: :meth:`StateVector.expvalue`
         """
-        evs = self.map(lambda sv:sv.expvalue(operator, indices, multi=multi),
-                       False)
         if not multi:
-            return expvalues.ExpectationValueTrajectory(evs, self.time, titles)
-        evs = numpy.array(evs).swapaxes(0,1)
-        return expvalues.ExpectationValueCollection(
-                            evs, self.time, titles, copy=False)
+            operator = (operator,)
+        squares = None
+        if indices is not None:
+            kept, summed = _kept_axes(self.ndim-1, indices)
+            squares = _cached(self, ("square", tuple(kept)))
+        evs = _expvalues(self, operator, indices, chunksize, squares)
+        return self._evs(evs, multi, titles)
 
-    def diagexpvalue(self, operator, indices=None, multi=False, titles=None):
+    def diagexpvalue(self, operator, indices=None, multi=False, titles=None,
+                     chunksize=None):
         """
         Calculate the expectation value of the diagonal operator for all SVs.
 
+        *Arguments*
+            * *chunksize* (optional)
+                Number of StateVectors which are processed at once. If None
+                it is chosen so that the temporary arrays stay small.
+
         *Returns*
             *evtraj*
                 An :class:`pycppqed.expvalues.ExpectationValuesTrajectory`
                 instance.
 
+        The cached result of :meth:`marginals` is used.
         See also: :meth:`StateVector.diagexpvalue`
         """
-        evs = self.map(lambda sv:sv.diagexpvalue(operator, indices,
-                            multi=multi), False)
         if not multi:
-            return expvalues.ExpectationValueTrajectory(evs, self.time, titles)
-        evs = numpy.array(evs).swapaxes(0,1)
+            operator = (operator,)
+        evs = _diagexpvalues(self._marginals(indices, chunksize), operator)
+        return self._evs(evs, multi, titles)
+
+    def marginals(self, indices=None, chunksize=None):
+        """
+        Return the probability distributions of the given subsystems.
+
+        *Returns*
+            * *marginals*
+                An array with the distribution of every StateVector along
+                the first axis.
+
+        The result is cached, a copy of it is returned, see
+        :meth:`clear_cache`. See also: :meth:`StateVector.marginal`
+        """
+        return self._marginals(indices, chunksize).copy()
+
+    def _marginals(self, indices=None, chunksize=None):
+        """
+        Return the cached distributions of the given subsystems.
+        """
+        kept, summed = _kept_axes(self.ndim-1, indices)
+        return _cached(self, ("marginal", tuple(kept)),
+                       lambda:_marginals(self, kept, summed, chunksize))
+
+    def cachemarginals(self, numbers=None, chunksize=None):
+        """
+        Calculate and cache the distributions of several single subsystems.
+
+        The state vectors are processed in chunks of *chunksize* points of
+        time. See also: :meth:`StateVector.cachemarginals`
+        """
+        for number, p in _single_marginals(self, self, numbers, chunksize):
+            _cached(self, ("marginal", (number,)), lambda:p)
+
+    def reducesquare(self, indices, chunksize=None):
+        """
+        Return the reduced Psi-square tensors of all StateVectors.
+
+        *Returns*
+            * *squares*
+                An array with the tensor of every StateVector along the
+                first axis.
+
+        The result is cached, a copy of it is returned, see
+        :meth:`clear_cache`. Once it is cached it is also used by
+        :meth:`expvalue`. See also: :meth:`StateVector.reducesquare`
+        """
+        summed = _sorted_list(_kept_axes(self.ndim-1, indices)[0])
+        kept = [i for i in range(self.ndim-1) if i not in summed]
+        return _cached(self, ("square", tuple(kept)),
+                       lambda:_squares(self, kept, summed, chunksize)).copy()
+
+    def clear_cache(self):
+        """
+        Forget all cached reductions of this StateVectorTrajectory.
+
+        See also: :meth:`StateVector.clear_cache`
+        """
+        _clear_cache(self)
+
+    def _evs(self, evs, multi, titles):
+        # Wrap an array with one row per operator into the returned class.
+        time = getattr(self, "time", None)
+        if not multi:
+            return expvalues.ExpectationValueTrajectory(evs[0], time, titles,
+                                                        copy=False)
         return expvalues.ExpectationValueCollection(
-                            evs, self.time, titles, copy=False)
+                            evs, time, titles, copy=False)
 
     def animate(self, x=None, y=None, re=False, im=False, abs=True):
         """
@@ -515,11 +742,330 @@ class StateVectorTrajectory(numpy.ndarray):
         return animate_statevector(self, x, y, re, im, abs)
 
 
+class _StateVectorList:
+    """
+    A sequence creating the StateVectors of a trajectory on access.
+
+    The created StateVectors are stored in the ``_views`` dictionary of the
+    trajectory.
+    """
+    def __init__(self, trajectory):
+        self.trajectory = trajectory
+        views = getattr(trajectory, "_views", None)
+        if views is None:
+            views = trajectory._views = {}
+        self.views = views
+
+    def __len__(self):
+        return self.trajectory.shape[0]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in xrange(*index.indices(len(self)))]
+        length = len(self)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError("StateVector index out of range.")
+        sv = self.views.get(index)
+        if sv is None:
+            traj = self.trajectory
+            time = getattr(traj, "time", None)
+            bases = getattr(traj, "bases", None)
+            sv = StateVector(numpy.ndarray.__getitem__(traj, index),
+                        time=(time[index] if time is not None else None),
+                        basis=(bases[index] if bases is not None else None),
+                        copy=False)
+            sv._trajectory = traj
+            sv._index = index
+            self.views[index] = sv
+        return sv
+
+    def __setitem__(self, index, value):
+        self.trajectory[index] = value
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+
+# Maximal size in bytes of the state vectors processed at once by
+# :func:`_expvalues` and :func:`_diagexpvalues`.
+_EXPVALUE_CHUNKBYTES = 1<<25
+
+def _chunks(svs, chunksize=None):
+    """
+    Yield slices of the first axis of svs with at most chunksize entries.
+    """
+    length = svs.shape[0]
+    if chunksize is None:
+        stepbytes = max(1, svs[:1].size*16)
+        chunksize = max(1, _EXPVALUE_CHUNKBYTES//stepbytes)
+    for start in xrange(0, length, chunksize):
+        yield slice(start, min(start+chunksize, length))
+
+def _kept_axes(ndim, indices):
+    """
+    Return the sorted lists of kept and of summed axes of a state vector.
+    """
+    if indices is None:
+        kept = range(ndim)
+    else:
+        if isinstance(indices, int):
+            indices = (indices,)
+        kept = _sorted_list(set(indices))
+    summed = [i for i in range(ndim) if i not in kept]
+    return kept, summed
+
+def _split_states(svs, kept, summed):
+    """
+    Return the state vectors reshaped to ``(n, kept size, summed size)``.
+    """
+    dims = svs.shape[1:]
+    K = int(numpy.prod([dims[i] for i in kept]))
+    M = int(numpy.prod([dims[i] for i in summed]))
+    axes = [0] + [i+1 for i in kept] + [i+1 for i in summed]
+    return _double(numpy.asarray(svs).transpose(axes)).reshape(-1, K, M)
+
+def _outer_expvalue(sv, operator, indices=None):
+    """
+    Calculate an expectation value by building the reduced Psi-square tensor.
+
+    This is the straightforward implementation of :meth:`StateVector.expvalue`
+    which needs memory of the size of the operator. It is kept as reference.
+    """
+    sv = _double(sv)
+    if indices is not None:
+        A = sv.reducesquare(_conjugate_indices(indices, sv.ndim))
+    else:
+        A = sv^sv.conjugate()
+    length = A.ndim
+    index = range(0, length, 2) + range(1, length, 2)
+    return numpy.asarray(A*numpy.asarray(operator).transpose(index)).sum()
+
+def _outer_diagexpvalue(sv, operator, indices=None):
+    """
+    Reference implementation of :meth:`StateVector.diagexpvalue`.
+    """
+    if isinstance(indices, int):
+        indices = (indices,)
+    sv = _double(sv)
+    A = sv*sv.conjugate()
+    if indices is not None:
+        indices = _sorted_list(_conjugate_indices(indices, sv.ndim), True)
+        for index in indices:
+            A = A.sum(index)
+    return numpy.asarray(A*operator).sum()
+
+def _expvalues(svs, operators, indices=None, chunksize=None, squares=None):
+    """
+    Calculate expectation values for an array of state vectors.
+
+    *Arguments*
+        * *svs*
+            An array with shape ``(n, d1, .., dn)`` holding n state vectors.
+
+        * *operators*
+            A list of operators, see :meth:`StateVector.expvalue`.
+
+        * *indices*, *chunksize* (optional)
+            See :meth:`StateVectorTrajectory.expvalue`.
+
+        * *squares* (optional)
+            The reduced Psi-square tensors of all state vectors for the
+            given indices. If given, they are used for dense operators.
+
+    *Returns*
+        * *evs*
+            A complex array with the shape ``(len(operators), n)``.
+
+    For every chunk of state vectors the operator is applied to all of them
+    at once with :func:`numpy.tensordot` (or its own method for sparse and
+    compact operators) and the result is contracted with the state vectors
+    again. A :class:`pycppqed.operators.TensorProductOperator` is applied
+    to the full state vectors, subsystem after subsystem.
+    """
+    kept, summed = _kept_axes(svs.ndim-1, indices)
+    ops = []
+    for op in operators:
+        if hasattr(op, "factors"):
+            if not set(op.factors).issubset(kept):
+                raise ValueError("Operator acts on subsystems which are "
+                                 "not taken.")
+        elif not _is_sparse(op):
+            op = numpy.asarray(op)
+            L = op.ndim
+            op = op.transpose(range(0, L, 2) + range(1, L, 2))
+            K = int(numpy.sqrt(op.size))
+            op = op.reshape(K, K)
+        ops.append(op)
+    evs = numpy.empty((len(ops), svs.shape[0]), dtype=complex)
+    done = [False]*len(ops)
+    if squares is not None:
+        squares = squares.reshape(svs.shape[0], -1)
+        for i, op in enumerate(ops):
+            if not (hasattr(op, "factors") or _is_sparse(op)):
+                evs[i] = numpy.dot(squares, op.ravel())
+                done[i] = True
+        if all(done):
+            return evs
+    for chunk in _chunks(svs, chunksize):
+        states = psi = None
+        for i, op in enumerate(ops):
+            if done[i]:
+                continue
+            if hasattr(op, "factors"):
+                if states is None:
+                    states = _double(numpy.asarray(svs[chunk]))
+                phi = op.apply(states.conjugate(), 1)
+                evs[i, chunk] = (states*phi).reshape(len(states), -1).sum(1)
+                continue
+            if psi is None:
+                psi = _split_states(svs[chunk], kept, summed)
+                cpsi = psi.conjugate()
+            if _is_sparse(op):
+                phi = apply_operator(op, cpsi.transpose(1, 0, 2))
+            else:
+                phi = numpy.tensordot(op, cpsi, (1, 1))
+            evs[i, chunk] = numpy.einsum("trm,rtm->t", psi, phi)
+    return evs
+
+def _is_sparse(op):
+    """
+    Return True if op is a ``scipy.sparse`` matrix or a compact operator.
+    """
+    return hasattr(op, "apply") or hasattr(op, "tocsr")
+
+def _diagexpvalues(marginals, operators):
+    """
+    Calculate expectation values of diagonal operators.
+
+    *Arguments*
+        * *marginals*
+            An array with the probability distributions of the taken
+            subsystems of n state vectors along the first axis.
+
+        * *operators*
+            A list of diagonal operators, see :meth:`StateVector.diagexpvalue`.
+
+    *Returns*
+        * *evs*
+            A complex array with the shape ``(len(operators), n)``.
+    """
+    shape = marginals.shape[1:]
+    p = marginals.reshape(marginals.shape[0], -1)
+    evs = numpy.empty((len(operators), marginals.shape[0]), dtype=complex)
+    for i, op in enumerate(operators):
+        op = numpy.asarray(op)
+        if op.shape != shape:
+            op = op + numpy.zeros(shape)
+        evs[i] = numpy.dot(p, op.ravel())
+    return evs
+
+def _marginals(svs, kept, summed, chunksize=None):
+    """
+    Calculate the probability distributions of the kept axes of state vectors.
+    """
+    shape = (svs.shape[0],) + tuple([svs.shape[i+1] for i in kept])
+    result = numpy.empty((svs.shape[0], int(numpy.prod(shape[1:]))))
+    for chunk in _chunks(svs, chunksize):
+        psi = _split_states(svs[chunk], kept, summed)
+        result[chunk] = (psi.real**2 + psi.imag**2).sum(axis=2)
+    return result.reshape(shape)
+
+def _single_marginals(obj, svs, numbers=None, chunksize=None):
+    """
+    Calculate the distributions of single subsystems which obj hasn't cached.
+
+    All distributions are derived from the same :math:`|\Psi|^2` of every
+    chunk of state vectors. A list of ``(number, marginals)`` is returned.
+    """
+    ndim = svs.ndim - 1
+    if numbers is None:
+        numbers = range(ndim)
+    numbers = [n for n in _sorted_list(set(numbers))
+               if _cached(obj, ("marginal", (n,))) is None]
+    if not numbers:
+        return []
+    result = [numpy.empty((svs.shape[0], svs.shape[n+1])) for n in numbers]
+    for chunk in _chunks(svs, chunksize):
+        psi = _double(numpy.asarray(svs[chunk]))
+        p = psi.real**2 + psi.imag**2
+        for n, marginals in zip(numbers, result):
+            axes = tuple([i+1 for i in range(ndim) if i != n])
+            marginals[chunk] = p.sum(axis=axes)
+    return zip(numbers, result)
+
+def _squares(svs, kept, summed, chunksize=None):
+    """
+    Calculate the reduced Psi-square tensors of the kept axes of state vectors.
+    """
+    dims = tuple([svs.shape[i+1] for i in kept])
+    K = int(numpy.prod(dims))
+    result = numpy.empty((svs.shape[0], K, K), dtype=complex)
+    for chunk in _chunks(svs, chunksize):
+        psi = _split_states(svs[chunk], kept, summed)
+        result[chunk] = numpy.einsum("trm,tcm->trc", psi, psi.conjugate())
+    return result.reshape((svs.shape[0],) + dims + dims)
+
+def _cache_of(obj, create=False):
+    """
+    Return the cache used by obj and the prefix of its keys.
+
+    A StateVector created by :attr:`StateVectorTrajectory.statevectors`
+    uses the cache of its trajectory with its index as prefix, so all of
+    them share one budget of :data:`REDUCTION_CACHEBYTES` bytes.
+    """
+    trajectory = getattr(obj, "_trajectory", None)
+    if trajectory is None:
+        owner, prefix = obj, ()
+    else:
+        owner, prefix = trajectory, (obj._index,)
+    cache = getattr(owner, "_cache", None)
+    if cache is None and create:
+        cache = owner._cache = utils.LRUCache(maxbytes=REDUCTION_CACHEBYTES)
+    return cache, prefix
+
+def _cached(obj, key, func=None):
+    """
+    Return the cached value for key or calculate and cache it with func.
+
+    The cache holds at most :data:`REDUCTION_CACHEBYTES` bytes, see
+    :func:`_cache_of`. The cached arrays are made read-only. If func is None
+    and nothing is cached, None is returned.
+    """
+    cache, prefix = _cache_of(obj)
+    key = prefix + key
+    if cache is not None and key in cache:
+        return cache[key]
+    if func is None:
+        return None
+    value = func()
+    value.flags.writeable = False
+    cache, prefix = _cache_of(obj, True)
+    cache[key] = value
+    return value
+
+def _clear_cache(obj):
+    """
+    Remove all entries of the cache created by :func:`_cached`.
+
+    A trajectory and its StateVectors share their data and their cache, so
+    the entries of all of them are removed at once, independent of the
+    number of StateVectors.
+    """
+    cache, prefix = _cache_of(obj)
+    if cache is not None:
+        cache.clear()
+
 def norm(array):
     """
     Return the norm of the array.
+
+    The sum is always accumulated in double precision.
     """
-    return numpy.sqrt((array*array.conj()).sum())
+    array = numpy.asarray(array)
+    return numpy.sqrt((array.real**2 + array.imag**2).sum(dtype=float))
 
 def normalize(array):
     """
@@ -537,6 +1083,15 @@ def adjust(array, length):
     X_new = numpy.linspace(0,1,length)
     return StateVector(f(X_new))
 
+def _double(array):
+    """
+    Return the array in double precision, single precision arrays are copied.
+    """
+    dtype = numpy.promote_types(array.dtype, numpy.float64)
+    if dtype == array.dtype:
+        return array
+    return array.astype(dtype)
+
 def _dim2str(dimensions):
     """
     Return the corresponding dimension string for the given nested tuple.
@@ -0,0 +1,76 @@
+import unittest
+import os
+import numpy
+import ensemble
+import expvalues
+import statevector
+
+eps = 1e-10
+
+class EnsembleTestCase(unittest.TestCase):
+    def test_expvalues(self):
+        time = numpy.linspace(0, 1, 7)
+        data = numpy.random.normal(1e6, 1e-3, (20, 3, 7))
+        acc = ensemble.ExpectationValueAccumulator()
+        for evs in data:
+            acc.add(expvalues.ExpectationValueCollection(evs, time,
+                                                         ("<x>", "<y>")))
+        self.assertEqual(acc.count, 20)
+        self.assert_((abs(acc.mean() - data.mean(axis=0)) < 1e-6).all())
+        self.assert_((abs(acc.std() - data.std(axis=0)) < 1e-9).all())
+        self.assert_((abs(acc.var(1) - data.var(axis=0, ddof=1)) < eps).all())
+        self.assertEqual(acc.mean().titles, ("<x>", "<y>", "?"))
+        self.assert_((acc.mean().time == time).all())
+        self.assertRaises(ValueError, acc.add, data[0,:2])
+        self.assertRaises(ValueError, acc.add,
+                  expvalues.ExpectationValueCollection(data[0], time + 1))
+
+    def test_densitymatrix(self):
+        shape = (5, 3, 4)
+        svts = []
+        acc = ensemble.DensityMatrixAccumulator(1)
+        acc.add(statevector.StateVectorTrajectory([]))
+        self.assertEqual(acc.count, 0)
+        self.assertRaises(ValueError, acc.density_matrix)
+        for i in range(4):
+            data = numpy.random.normal(size=shape) + \
+                   1j*numpy.random.normal(size=shape)
+            svt = statevector.StateVectorTrajectory(
+                    [statevector.StateVector(sv, norm=True) for sv in data],
+                    time=numpy.arange(shape[0]))
+            svts.append(svt)
+            acc.add(svt)
+            self.assert_(getattr(svt, "_cache", None) is None)
+        acc.add(statevector.StateVectorTrajectory([]))
+        self.assertEqual(acc.count, 4)
+        rho = acc.density_matrix()
+        self.assertEqual(rho.shape, (5, 3, 3))
+        for t in range(shape[0]):
+            expected = sum(numpy.dot(svt[t], svt[t].conjugate().T)
+                           for svt in svts)/len(svts)
+            self.assert_((abs(rho[t] - expected) < eps).all())
+            self.assert_(abs(numpy.trace(rho[t]) - 1) < eps)
+
+    def test_averagecppqed(self):
+        basedir = os.path.abspath(os.path.dirname(__file__))
+        path = os.path.join(basedir, "test/cppqed/ring.dat")
+        evacc, rhoacc = ensemble.average_cppqed([path]*3, (1,2), every=2)
+        evs, qs = ensemble.io.load_cppqed(path, every=2)
+        self.assertEqual(evacc.count, 3)
+        self.assert_((abs(evacc.mean() - evs) < eps).all())
+        self.assert_((abs(evacc.std()) < eps).all())
+        rho = rhoacc.density_matrix()
+        for i, sv in enumerate(qs.statevector.statevectors):
+            self.assert_((abs(rho[i] - sv.reducesquare((1,2))) < eps).all())
+
+
+def suite():
+    load = unittest.defaultTestLoader.loadTestsFromTestCase
+    suite = unittest.TestSuite([
+            load(EnsembleTestCase),
+            ])
+    return suite
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,6 +5,8 @@ import statevector
 import numpy
 import tempfile
 import shutil
+import gzip
+import bz2
 
 eps = 1e-10
 
@@ -29,6 +31,42 @@ class BlitzTestCase(unittest.TestCase):
             self.assert_((numpy.abs(a-na2)<eps).all())
         io.cio = cio
 
+    def test_writeblitz(self):
+        chunksize = io._BLITZ_CHUNKSIZE
+        io._BLITZ_CHUNKSIZE = 3
+        try:
+            for a in self.arrays:
+                a = a*(1-0.1j)
+                f = tempfile.TemporaryFile()
+                io._write_blitz(f, a)
+                f.seek(0)
+                blitzstr = f.read()
+                f.close()
+                self.assertEqual(blitzstr.count("\n"), a.size/a.shape[-1]+2)
+                self.assert_((io._blitz2numpy(blitzstr)==a).all())
+            # Layout written by the formatter before _write_blitz existed.
+            io._BLITZ_CHUNKSIZE = 2
+            a = numpy.array([[1, 2.5j, -3], [0.1, 1e-20-1j, 4]])
+            self.assertEqual(io._numpy2blitz(a),
+                             "(0,1) x (0,2) \n"
+                             "[ (1.0,0.0) (0.0,2.5) (-3.0,0.0) \n"
+                             "  (0.1,0.0) (1e-20,-1.0) (4.0,0.0) ]\n\n")
+            self.assertEqual(io._numpy2blitz(a.reshape((1,2,3))),
+                             "(0,0) x (0,1) x (0,2) \n"
+                             "[ (1.0,0.0) (0.0,2.5) (-3.0,0.0) \n"
+                             "  (0.1,0.0) (1e-20,-1.0) (4.0,0.0) ]\n\n")
+        finally:
+            io._BLITZ_CHUNKSIZE = chunksize
+
+    def test_blitzlength(self):
+        cio = io.cio
+        io.cio = None
+        try:
+            self.assertRaises(ValueError, io._blitz2numpy,
+                              "(0,2)\n[ (1,2) (3,4) ]")
+        finally:
+            io.cio = cio
+
     def test_cblitz(self):
         if io.cio is None:
             raise Exception("Can't test c extension!")
@@ -40,6 +78,54 @@ class BlitzTestCase(unittest.TestCase):
             self.assert_((a==na1).all())
             self.assert_((a==na2).all())
 
+    def test_cparseinto(self):
+        if io.cio is None:
+            raise Exception("Can't test c extension!")
+        parse_into = io.cio.parse_into
+        datastr = "[ (1,-2) (3.5,4e-3) \n  (-0,1e10) ]"
+        a = numpy.empty(3, dtype=complex)
+        parse_into(datastr, a)
+        self.assert_((a==(1-2j, 3.5+4e-3j, 1e10j)).all())
+        parse_into(buffer(" " + datastr, 1), a)
+        self.assert_((a==(1-2j, 3.5+4e-3j, 1e10j)).all())
+        self.assertRaises(ValueError, parse_into, datastr,
+                          numpy.empty(4, dtype=complex))
+        self.assertRaises(ValueError, parse_into, datastr,
+                          numpy.empty(2, dtype=complex))
+        self.assertRaises(TypeError, parse_into, datastr,
+                          numpy.empty(3, dtype=float))
+        for malformed in ("[ (1,2) (abc,1) ]", "[ (1,2) (1,) ]",
+                          "[ (1,2) (1 2,3) ]", "[ (1,2) (1,2 ]"):
+            self.assertRaises(ValueError, parse_into, malformed,
+                              numpy.empty(2, dtype=complex))
+        parse_into("[ (1 , 2 ) ( 3,4) ]", a[:2])
+        # Nothing beyond the end of a buffer is read.
+        cutstr = "[ (1,2) (3,45) ]"
+        self.assertRaises(ValueError, parse_into, buffer(cutstr, 0, 12), a[:2])
+        parse_into(buffer(cutstr, 0, 14), a[:2])
+        self.assert_((a[:2]==(1+2j, 3+45j)).all())
+        a = numpy.empty(3, dtype=numpy.complex64)
+        parse_into(datastr, a)
+        self.assert_((a==numpy.array((1-2j, 3.5+4e-3j, 1e10j),
+                                     dtype=numpy.complex64)).all())
+
+    def test_cparsethreads(self):
+        if io.cio is None:
+            raise Exception("Can't test c extension!")
+        import threading
+        blitzstrs = [io._numpy2blitz(a) for a in self.arrays]
+        results = [None]*len(blitzstrs)
+        def parse(i):
+            results[i] = io._blitz2numpy(blitzstrs[i])
+        threads = [threading.Thread(target=parse, args=(i,))
+                   for i in range(len(blitzstrs))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        for a, na in zip(self.arrays, results):
+            self.assert_((a==na).all())
+
     def test_loadblitz(self):
         basedir = os.path.dirname(os.path.abspath(__file__))
         testdir = os.path.join(basedir, "test/blitzarray")
@@ -67,6 +153,285 @@ class CppqedTestCase(unittest.TestCase):
             path = os.path.join(testdir, name)
             evs, qs = io.load_cppqed(path)
 
+    def test_loadcppqedmmap(self):
+        testdir = self.cppqeddir
+        for name in os.listdir(testdir):
+            path = os.path.join(testdir, name)
+            evs, qs = io.load_cppqed(path)
+            evs2, qs2 = io.load_cppqed(path, mmap=True)
+            self.assert_((evs2==evs).all())
+            self.assert_((qs2.statevector==qs.statevector).all())
+            self.assertEqual(evs2.titles, evs.titles)
+
+    def test_loadcppqedcache(self):
+        path = os.path.join(self.cppqeddir, "ring.dat")
+        evs, qs = io.load_cppqed(path)
+        cachedir = tempfile.mkdtemp(prefix="pycppqed_test_")
+        try:
+            self.assert_(io._load_cache(path, cachedir) is None)
+            for i in range(2):
+                evs2, qs2 = io.load_cppqed(path, cache=cachedir)
+                self.assert_(io._load_cache(path, cachedir) is not None)
+                self.assert_((evs2==evs).all())
+                self.assert_((qs2.statevector==qs.statevector).all())
+                self.assert_((qs2.statevector.time==qs.statevector.time).all())
+                self.assertEqual(evs2.titles, evs.titles)
+        finally:
+            shutil.rmtree(cachedir)
+
+    def test_lazytrajectory(self):
+        path = os.path.join(self.cppqeddir, "ring.dat")
+        evs, qs = io.load_cppqed(path)
+        svs = qs.statevector
+        lazy = io.LazyStateVectorTrajectory(path, cachesize=2)
+        self.assertEqual(len(lazy), len(svs))
+        self.assert_((lazy.time==svs.time).all())
+        for i in range(-len(svs), len(svs)):
+            self.assert_((lazy[i]==svs[i]).all())
+            self.assertEqual(lazy[i].time, svs.time[i])
+        self.assertEqual(len(lazy._cache), 2)
+        self.assertRaises(IndexError, lambda:lazy[len(svs)])
+        self.assert_((lazy[1::3].load()==svs[1::3]).all())
+        self.assert_((lazy[1::3].time==svs.time[1::3]).all())
+        self.assertEqual(lazy.index(svs.time[4]+1e-10), 4)
+        self.assert_((lazy.at(svs.time[4])==svs[4]).all())
+
+    def test_follower(self):
+        readpath = os.path.join(self.cppqeddir, "ring.dat")
+        evs, qs = io.load_cppqed(readpath)
+        f = open(readpath)
+        buf = f.read()
+        f.close()
+        tempdirpath = tempfile.mkdtemp(prefix="pycppqed_test_")
+        try:
+            writepath = os.path.join(tempdirpath, "ring.dat")
+            f = open(writepath, "w")
+            follower = io.CppqedFollower(writepath)
+            self.assert_(not follower.poll())
+            for pos in range(0, len(buf), 70001):
+                f.write(buf[pos:pos+70001])
+                f.flush()
+                follower.poll()
+                if follower.evs is not None:
+                    length = follower.evs.shape[1]
+                    self.assert_((follower.evs==evs[:,:length]).all())
+            f.close()
+            self.assert_(not follower.poll())
+            self.assert_((follower.evs==evs).all())
+            self.assert_((follower.qs.statevector==qs.statevector).all())
+            self.assertEqual(follower.evs.titles, evs.titles)
+            self.assert_((follower.qs.statevector.time==qs.statevector.time)
+                         .all())
+            evt = follower.evs.evtrajectories[2]
+            self.assert_((evt==evs.evtrajectories[2]).all())
+            self.assert_(numpy.may_share_memory(evt, follower.evs))
+        finally:
+            shutil.rmtree(tempdirpath)
+
+    def test_loadexpvalues(self):
+        testdir = self.cppqeddir
+        for name in os.listdir(testdir):
+            path = os.path.join(testdir, name)
+            evs, qs = io.load_cppqed(path)
+            evs2 = io.load_expvalues(path)
+            self.assert_((evs2==evs).all())
+            self.assertEqual(evs2.titles, evs.titles)
+            self.assertEqual(evs2.subsystems.keys(), evs.subsystems.keys())
+
+    def test_loadcppqedselection(self):
+        path = os.path.join(self.cppqeddir, "ring.dat")
+        evs, qs = io.load_cppqed(path)
+        svs = qs.statevector
+        evsel = numpy.nonzero((evs.time>=0.1) & (evs.time<=0.7))[0][::3]
+        svsel = numpy.nonzero((svs.time>=0.1) & (svs.time<=0.7))[0][::2]
+        for mmap in (False, True):
+            evs2, qs2 = io.load_cppqed(path, mmap=mmap, tmin=0.1, tmax=0.7,
+                                       ev_every=3, sv_every=2)
+            self.assert_((evs2==evs[:,evsel]).all())
+            self.assert_((qs2.statevector==svs[svsel]).all())
+            self.assert_((qs2.statevector.time==svs.time[svsel]).all())
+            evs3, qs3 = io.load_cppqed(path, mmap=mmap, every=4)
+            self.assert_((evs3==evs[:,::4]).all())
+            self.assert_((qs3.statevector==svs[::4]).all())
+
+    def test_loadcppqedempty(self):
+        path = os.path.join(self.cppqeddir, "ring.dat")
+        evs, qs = io.load_cppqed(path)
+        for mmap in (False, True):
+            evs2, qs2 = io.load_cppqed(path, mmap=mmap, tmin=1e9)
+            self.assertEqual(evs2.shape, (evs.shape[0], 0))
+            self.assertEqual(evs2.time.shape, (0,))
+            self.assertEqual(len(qs2.statevector), 0)
+            evs3, qs3 = io.load_cppqed(path, mmap=mmap, tmin=1e9,
+                                       subsystems=1)
+            self.assertEqual(evs3.shape, (6, 0))
+        f = open(path)
+        kind, commentstr = io._iter_cppqed_output(f).next()
+        f.close()
+        tempdirpath = tempfile.mkdtemp(prefix="pycppqed_test_")
+        try:
+            emptypath = os.path.join(tempdirpath, "empty.dat")
+            f = open(emptypath, "w")
+            f.write(commentstr + "\n\n")
+            f.close()
+            titles = io._expvalue_layout(commentstr)[0]
+            self.assertEqual(io.load_expvalues(emptypath).shape,
+                             (len(titles), 0))
+        finally:
+            shutil.rmtree(tempdirpath)
+
+    def test_loadcppqedsubsystems(self):
+        path = os.path.join(self.cppqeddir, "ring.dat")
+        evs, qs = io.load_cppqed(path)
+        for mmap in (False, True):
+            evs2, qs2 = io.load_cppqed(path, mmap=mmap, subsystems="Mode")
+            self.assertEqual(evs2.subsystems.keys(), ["(1)Mode", "(2)Mode"])
+            self.assert_((evs2[2:]==evs[6:14]).all())
+            self.assert_((evs2[:2]==evs[:2]).all())
+            self.assert_((qs2.statevector==qs.statevector).all())
+        evs3 = io.load_expvalues(path, subsystems=[0, "<number operator>"])
+        self.assertEqual(evs3.subsystems.keys(),
+                         ["(0)Particle", "(1)Mode", "(2)Mode"])
+        self.assert_((evs3[2:6]==evs[2:6]).all())
+        self.assert_((evs3[6:]==evs[[6,10]]).all())
+        self.assertRaises(ValueError, io.load_expvalues, path,
+                          subsystems="Spin")
+
+    def test_loadcppqeddtype(self):
+        path = os.path.join(self.cppqeddir, "ring.dat")
+        evs, qs = io.load_cppqed(path)
+        cachedir = tempfile.mkdtemp(prefix="pycppqed_test_")
+        try:
+            for kwargs in ({}, {"mmap":True}, {"cache":cachedir},
+                           {"cache":cachedir}):
+                evs2, qs2 = io.load_cppqed(path, dtype=numpy.complex64,
+                                           **kwargs)
+                svs2 = qs2.statevector
+                self.assertEqual(evs2.dtype, numpy.float32)
+                self.assertEqual(svs2.dtype, numpy.complex64)
+                self.assertEqual(svs2.statevectors[0].dtype, numpy.complex64)
+                self.assert_((evs2==evs.astype(numpy.float32)).all())
+                self.assertEqual(evs2.time.dtype, numpy.float64)
+                self.assert_((evs2.time==evs.time).all())
+                self.assertEqual(evs2.evtrajectories[3].time.dtype,
+                                 numpy.float64)
+                self.assert_((svs2==qs.statevector.astype(numpy.complex64))\
+                             .all())
+            evs3, qs3 = io.load_cppqed(path, cache=cachedir)
+            self.assertEqual(qs3.statevector.dtype, complex)
+        finally:
+            shutil.rmtree(cachedir)
+
+    def test_loadcompressed(self):
+        path = os.path.join(self.cppqeddir, "ring.dat")
+        evs, qs = io.load_cppqed(path)
+        data = open(path).read()
+        tempdirpath = tempfile.mkdtemp(prefix="pycppqed_test_")
+        try:
+            for name, opener in (("ring.dat.gz", gzip.open),
+                                 ("ring.dat.bz2", bz2.BZ2File)):
+                readpath = os.path.join(tempdirpath, name)
+                f = opener(readpath, "wb")
+                f.write(data)
+                f.close()
+                for mmap in (False, True):
+                    evs2, qs2 = io.load_cppqed(readpath, mmap=mmap)
+                    self.assert_((evs2==evs).all())
+                    self.assert_((qs2.statevector==qs.statevector).all())
+                self.assert_((io.load_expvalues(readpath)==evs).all())
+                self.assertRaises(ValueError, io.LazyStateVectorTrajectory,
+                                  readpath)
+                writepath = os.path.join(tempdirpath, "split", name)
+                os.mkdir(os.path.dirname(writepath))
+                io.split_cppqed(readpath, writepath)
+                evs3, qs3 = io.load_cppqed(writepath)
+                self.assert_((evs3==evs).all())
+                shutil.rmtree(os.path.dirname(writepath))
+            sv = qs.statevector.statevectors[3]
+            svpath = os.path.join(tempdirpath, "sv.gz")
+            io.save_statevector(os.path.join(tempdirpath, "sv"), sv)
+            f = gzip.open(svpath, "wb")
+            f.write(open(os.path.join(tempdirpath, "sv")).read())
+            f.close()
+            sv2 = io.load_statevector(svpath)
+            self.assert_((sv2==sv).all())
+            self.assertEqual(sv2.time, sv.time)
+        finally:
+            shutil.rmtree(tempdirpath)
+
+    def test_loadmany(self):
+        paths = [os.path.join(self.cppqeddir, name)
+                 for name in ("ring.dat", "o10.dat")]
+        paths.insert(1, os.path.join(self.cppqeddir, "nonexistent.dat"))
+        paths.append(paths[0])
+        for workers in (1, 2):
+            results = io.load_many(paths, workers=workers, tmin=0.2)
+            self.assertEqual(len(results), 4)
+            self.assert_(isinstance(results[1], EnvironmentError))
+            self.assert_("nonexistent.dat" in str(results[1]))
+            for path, result in zip(paths[::2] + paths[3:], results[::2] +
+                                    results[3:]):
+                evs, qs = io.load_cppqed(path, tmin=0.2)
+                self.assert_((result[0]==evs).all())
+                self.assertEqual(result[0].titles, evs.titles)
+                if qs.statevector is not None:
+                    self.assert_((result[1].statevector==qs.statevector).all())
+        self.assertRaises(TypeError, io.load_many, paths, tmn=0.2)
+        error = io._rebuild_error("ValueError", "message")
+        self.assertEqual((type(error), str(error)), (ValueError, "message"))
+        error = io._rebuild_error("BlitzError", "message")
+        self.assertEqual((type(error), str(error)),
+                         (RuntimeError, "BlitzError: message"))
+
+    def test_loadstatevectors(self):
+        readpath = os.path.join(self.cppqeddir, "ring.dat")
+        evs, qs = io.load_cppqed(readpath)
+        svs = qs.statevector
+        tempdirpath = tempfile.mkdtemp(prefix="pycppqed_test_")
+        try:
+            writepath = os.path.join(tempdirpath, "cppqed")
+            io.split_cppqed(readpath, writepath)
+            for workers in (None, 3):
+                svs2 = io.load_statevectors(writepath, workers=workers)
+                self.assert_((svs2==svs).all())
+                self.assert_((svs2.time==svs.time).all())
+                self.assertEqual(svs2.statevectors[1].time, svs.time[1])
+            self.assertRaises(ValueError, io.load_statevectors,
+                              os.path.join(tempdirpath, "other"))
+            io.split_cppqed(readpath, writepath + "_2")
+            svs3 = io.load_statevectors(writepath)
+            self.assert_((svs3.time==svs.time).all())
+            shutil.copy(writepath + "_0.000000.sv", writepath + "_0.sv")
+            self.assertRaises(ValueError, io.load_statevectors, writepath)
+        finally:
+            shutil.rmtree(tempdirpath)
+
+    def test_splitselection(self):
+        readpath = os.path.join(self.cppqeddir, "ring.dat")
+        evs, qs = io.load_cppqed(readpath, tmin=0.5)
+        tempdirpath = tempfile.mkdtemp(prefix="pycppqed_test_")
+        try:
+            writepath = os.path.join(tempdirpath, "cppqed")
+            io.split_cppqed(readpath, writepath, tmin=0.5)
+            evs2, qs2 = io.load_cppqed(writepath)
+            svnames = os.listdir(tempdirpath)
+            self.assertEqual(len(svnames), len(qs.statevector)+1)
+            self.assert_((evs2==evs).all())
+        finally:
+            shutil.rmtree(tempdirpath)
+
+    def test_itercppqed(self):
+        path = os.path.join(self.cppqeddir, "ring.dat")
+        f = open(path)
+        kinds = [kind for kind, data in io._iter_cppqed_output(f)]
+        f.close()
+        self.assertEqual(kinds[0], "comment")
+        self.assertEqual(kinds.count("comment"), 1)
+        self.assertEqual(kinds.count("sv"), 9)
+        evs, qs = io.load_cppqed(path)
+        self.assertEqual(kinds.count("ev"), evs.shape[1])
+        self.assertEqual(qs.statevector.shape, (9, 64, 10, 10))
+
     def test_saveloadstatevector(self):
         SV = statevector.StateVector
         a = SV((1,2,3), time=1)
@@ -0,0 +1,96 @@
+import unittest
+import numpy
+import operators
+import statevector
+
+eps = 1e-12
+
+class BandedOperatorTestCase(unittest.TestCase):
+    def setUp(self):
+        shape = (4, 6, 5)
+        data = numpy.random.normal(size=(3,)+shape) + \
+               1j*numpy.random.normal(size=(3,)+shape)
+        self.svt = statevector.StateVectorTrajectory(
+                [statevector.StateVector(sv, norm=True) for sv in data],
+                time=numpy.arange(3))
+        self.sv = self.svt.statevectors[1]
+
+    def op(self, dim):
+        return operators.BandedOperator({
+                -1: numpy.sqrt(numpy.arange(1, dim)),
+                0: 0.5,
+                2: 1j*numpy.arange(dim-2),
+                }, dim)
+
+    def test_todense(self):
+        a = operators.BandedOperator({-1: numpy.sqrt(numpy.arange(1, 6))}, 6)
+        dense = numpy.diag(numpy.sqrt(numpy.arange(1, 6)), -1)
+        self.assert_((a.todense()==dense).all())
+        self.assert_((a.transpose().todense()==dense.T).all())
+        op = self.op(6)
+        self.assert_((op.conjugate().todense()==op.todense().conj()).all())
+        x = numpy.random.normal(size=(6, 3))
+        self.assert_((abs(op.apply(x)-numpy.dot(op.todense(), x))<eps).all())
+        self.assertRaises(ValueError, operators.BandedOperator, {1: (1, 2)}, 6)
+        self.assertRaises(ValueError, operators.BandedOperator, {6: 1}, 6)
+
+    def test_expvalue(self):
+        op = self.op(6)
+        dense = op.todense()
+        ev = self.sv.expvalue(op, 1)
+        self.assert_(abs(ev - self.sv.expvalue(dense, 1)) < eps)
+        evs = self.svt.expvalue(op, 1)
+        self.assert_((abs(evs - self.svt.expvalue(dense, 1)) < eps).all())
+
+    def test_sparse(self):
+        import scipy.sparse
+        dense = numpy.kron(self.op(4).todense(), self.op(5).todense())
+        A = scipy.sparse.csr_matrix(dense)
+        op = dense.reshape(4, 5, 4, 5).transpose(0, 2, 1, 3)
+        ev = self.sv.expvalue(A, (0, 2))
+        self.assert_(abs(ev - self.sv.expvalue(op, (0, 2))) < eps)
+        evs = self.svt.expvalue((A, A.T), (0, 2), multi=True)
+        self.assert_((abs(evs[0] - self.svt.expvalue(op, (0, 2))) < eps)
+                     .all())
+
+
+class TensorProductOperatorTestCase(unittest.TestCase):
+    def setUp(self):
+        self.shape = shape = (3, 4, 5, 2)
+        data = numpy.random.normal(size=(3,)+shape) + \
+               1j*numpy.random.normal(size=(3,)+shape)
+        self.svt = statevector.StateVectorTrajectory(
+                [statevector.StateVector(sv, norm=True) for sv in data],
+                time=numpy.arange(3))
+        a = operators.BandedOperator({-1: numpy.sqrt(numpy.arange(1, 4))}, 4)
+        sigma = numpy.array(((0, 1), (1j, 0)))
+        self.op = operators.TensorProductOperator({1: a, 3: sigma})
+
+    def test_expvalue(self):
+        sv = self.svt.statevectors[2]
+        dense = self.op.todense(self.shape)
+        self.assertEqual(dense.shape, (3,3,4,4,5,5,2,2))
+        ref = statevector._outer_expvalue(sv, dense)
+        self.assert_(abs(sv.expvalue(self.op) - ref) < eps)
+        reduced = self.op.todense((1, 4, 1, 2))[0,0,:,:,0,0]
+        ref = statevector._outer_expvalue(sv, reduced, (1,3))
+        self.assert_(abs(sv.expvalue(self.op, (1,3)) - ref) < eps)
+        self.assertRaises(ValueError, sv.expvalue, self.op, 1)
+
+    def test_trajectory(self):
+        evs = self.svt.expvalue((self.op, self.op.todense(self.shape)),
+                                multi=True, chunksize=2)
+        self.assert_((abs(evs[0] - evs[1]) < eps).all())
+
+
+def suite():
+    load = unittest.defaultTestLoader.loadTestsFromTestCase
+    suite = unittest.TestSuite([
+            load(BandedOperatorTestCase),
+            load(TensorProductOperatorTestCase),
+            ])
+    return suite
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+import unittest
+import numpy
+import quantumsystem
+import statevector
+
+eps = 1e-12
+
+class QuantumSystemCompoundTestCase(unittest.TestCase):
+    def setUp(self):
+        shape = (5, 16, 6, 4)
+        data = numpy.random.normal(size=shape) + \
+               1j*numpy.random.normal(size=shape)
+        self.svt = statevector.StateVectorTrajectory(
+                [statevector.StateVector(sv, norm=True) for sv in data],
+                time=numpy.arange(shape[0]))
+        self.qs = quantumsystem.QuantumSystemCompound(self.svt,
+                    quantumsystem.Particle, quantumsystem.Mode,
+                    quantumsystem.Mode)
+
+    def test_expvalues(self):
+        evs = self.qs.expvalues(chunksize=2)
+        self.assertEqual(len(evs), 12)
+        self.assertEqual(evs.subsystems.keys(),
+                         ["(0)Particle", "(1)Mode", "(2)Mode"])
+        marginals = [self.svt.marginals(i) for i in range(3)]
+        self.svt.clear_cache()
+        for i, sub in enumerate(evs.subsystems.values()):
+            ref = self.qs.subsystems[i].expvalues()
+            self.assert_((abs(sub - ref) < eps).all())
+            self.assert_((abs(self.svt.marginals(i) - marginals[i]) < eps)
+                         .all())
+
+    def test_chunksize(self):
+        calls = []
+        particle = self.qs.subsystems[0]
+        def expvalues(k=True, x=True, chunksize=None):
+            calls.append(chunksize)
+            return quantumsystem.Particle.expvalues(particle, k, x, chunksize)
+        particle.expvalues = expvalues
+        evs = self.qs.expvalues(chunksize=2)
+        self.assertEqual(calls, [2])
+        self.assertEqual(len(evs), 12)
+
+    def test_statevector(self):
+        sv = self.svt.statevectors[3]
+        qs = quantumsystem.QuantumSystemCompound(sv, quantumsystem.Particle,
+                    quantumsystem.Mode, quantumsystem.Mode)
+        evs = qs.expvalues((1, 2))
+        self.assertEqual(len(evs), 8)
+        self.assert_((abs(sv.marginal(2) - sv.marginal((2,))) < eps).all())
+        self.assert_((abs(evs - self.qs.expvalues((1, 2))[:,3]) < eps).all())
+
+    def test_moments(self):
+        a = numpy.diag(numpy.sqrt(numpy.arange(1, 6)), -1)
+        mode = self.qs.subsystems[1]
+        moments = mode.moments((1, 2, 3, 6), chunksize=2)
+        self.assertEqual(moments.shape, (4, 5))
+        for i, k in enumerate((1, 2, 3)):
+            ref = self.svt.expvalue(numpy.linalg.matrix_power(a, k), 1)
+            self.assert_((abs(moments[i] - ref) < eps).all())
+        self.assert_((moments[3] == 0).all())
+        sv = self.svt.statevectors[2]
+        moments = quantumsystem.Mode(sv, 1).moments()
+        self.assertEqual(moments.shape, (2,))
+        self.assert_(abs(moments[1] - sv.expvalue(numpy.dot(a, a), 1)) < eps)
+
+    def test_particle(self):
+        for dim in (16, 15):
+            svt = statevector.StateVectorTrajectory(
+                    [self.svt.statevectors[i][:dim] for i in range(5)],
+                    time=numpy.arange(5))
+            particle = quantumsystem.Particle(svt, 0)
+            evs = particle.expvalues(chunksize=2, workers=2)
+            K = numpy.arange(-dim/2, dim/2)
+            X = numpy.linspace(-numpy.pi, numpy.pi, dim, endpoint=False)
+            svt_x = svt.fft(0)
+            for i, sv in enumerate(svt.statevectors):
+                ev = sv.diagexpvalue((K, K**2), 0, multi=True)
+                self.assert_(abs(evs[0,i] - ev[0]) < eps)
+                self.assert_(abs(evs[1,i] - (ev[1] - ev[0]**2)) < eps)
+                sv_x = svt_x.statevectors[i]
+                ev = sv_x.diagexpvalue((X, X**2), 0, multi=True)*2*numpy.pi/dim
+                self.assert_(abs(evs[2,i] - ev[0]) < eps)
+                self.assert_(abs(evs[3,i] - numpy.sqrt(ev[1] - ev[0]**2))
+                             < eps)
+            k_moments, x_moments = particle.moments((3,), k=False)
+            self.assertEqual(k_moments, None)
+            ev = svt_x.diagexpvalue(X**3, 0)*2*numpy.pi/dim
+            self.assert_((abs(x_moments[0] - ev) < eps).all())
+        sv = self.svt.statevectors[1]
+        evs = quantumsystem.Particle(sv, 0).expvalues()
+        self.assert_((abs(evs - self.qs.expvalues((0,))[:,1]) < eps).all())
+
+
+def suite():
+    load = unittest.defaultTestLoader.loadTestsFromTestCase
+    suite = unittest.TestSuite([
+            load(QuantumSystemCompoundTestCase),
+            ])
+    return suite
+
+
+if __name__ == "__main__":
+    unittest.main()
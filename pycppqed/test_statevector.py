@@ -41,6 +41,40 @@ class StateVectorTestCase(unittest.TestCase):
         rsv = sv.reducesquare(2)
         self.assertEqual(rsv.shape, (3,4,3,4))
 
+    def test_reductioncache(self):
+        sv = statevector.StateVector((3,2,6,7), norm=True) ^ \
+             statevector.StateVector((1,1j,2), norm=True)
+        rsv = sv.reducesquare(1)
+        self.assert_(("square", (0,)) in sv._cache)
+        rsv[0] = 0
+        self.assert_((abs(sv.reducesquare((1,))[0] -
+                          numpy.dot(sv.conjugate(), sv[0])) < 1e-12).all())
+        p = sv.marginal(0)
+        X = numpy.arange(16.).reshape(4,4) + 1j
+        ev = sv.expvalue(X, 0)
+        self.assert_(abs(ev - statevector._outer_expvalue(sv, X, 0)) < 1e-12)
+        sv *= 2
+        self.assertEqual(len(sv._cache), 0)
+        self.assert_((abs(sv.marginal(0) - 4*p) < 1e-12).all())
+        sv[0] = 0
+        self.assertEqual(sv.marginal(0)[0], 0)
+        sv.clear_cache()
+        self.assertEqual(len(sv._cache), 0)
+        ev = sv.expvalue(X, 0)
+        self.assertEqual(len(sv._cache), 0)
+        maxbytes = statevector.REDUCTION_CACHEBYTES
+        statevector.REDUCTION_CACHEBYTES = 3<<19
+        try:
+            sv = statevector.StateVector(numpy.ones((16, 16, 16), complex))
+            for i in range(3):
+                sv.reducesquare(i)
+            self.assertEqual(len(sv._cache), 1)
+            self.assert_(("square", (0, 1)) in sv._cache)
+            sv.marginal(0)
+            self.assertEqual(len(sv._cache), 2)
+        finally:
+            statevector.REDUCTION_CACHEBYTES = maxbytes
+
     def test_fft(self):
         sv_k = initialconditions.gaussian(0.5,2,0.3)
         sv_x = sv_k.fft()
@@ -64,6 +98,27 @@ class StateVectorTestCase(unittest.TestCase):
         self.assert_(isinstance(ev, expvalues.ExpectationValueCollection))
         self.assertEqual(ev.shape, (2,))
 
+    def test_matrixfreeexpvalue(self):
+        shape = (3,4,5)
+        sv = statevector.StateVector(numpy.random.normal(size=shape) +
+                                     1j*numpy.random.normal(size=shape),
+                                     norm=True)
+        def op(*dims):
+            size = numpy.prod(dims)
+            A = numpy.random.normal(size=(size,size)) + \
+                1j*numpy.random.normal(size=(size,size))
+            A = A.reshape(dims+dims)
+            n = len(dims)
+            return A.transpose(sum([[i, i+n] for i in range(n)], []))
+        for indices, dims in ((None, shape), (0, (3,)), ((2,0), (3,5)),
+                              ((1,2), (4,5))):
+            A = op(*dims)
+            ref = statevector._outer_expvalue(sv, A, indices)
+            self.assert_(abs(sv.expvalue(A, indices) - ref) < 1e-12)
+            D = numpy.random.normal(size=dims)
+            ref = statevector._outer_diagexpvalue(sv, D, indices)
+            self.assert_(abs(sv.diagexpvalue(D, indices) - ref) < 1e-12)
+
     def test_diagexpvalue(self):
         sv1 = statevector.StateVector((1,1,1), norm=True)
         sv2 = statevector.StateVector((1,2,3,4), norm=True)
@@ -80,6 +135,20 @@ class StateVectorTestCase(unittest.TestCase):
         self.assert_(isinstance(ev, expvalues.ExpectationValueCollection))
         self.assertEqual(ev.shape, (2,))
 
+    def test_singleprecision(self):
+        X = numpy.linspace(-1, 1, 1000)
+        sv = statevector.StateVector(numpy.exp(-X**2+1j*X), norm=True,
+                                     dtype=numpy.complex64)
+        self.assertEqual(sv.dtype, numpy.complex64)
+        self.assertEqual(sv.normalize().dtype, numpy.complex64)
+        self.assertEqual(sv.norm().dtype, numpy.float64)
+        self.assert_(abs(sv.norm()-1) < 1e-6)
+        sv2 = sv.astype(complex)
+        A = numpy.diag(numpy.arange(1000.))
+        self.assert_(abs(sv.expvalue(A) - sv2.expvalue(A)) < 1e-10)
+        self.assert_(abs(sv.diagexpvalue(numpy.arange(1000.)) -
+                         sv2.diagexpvalue(numpy.arange(1000.))) < 1e-10)
+
     def test_outer(self):
         sv1 = statevector.StateVector((1,2), norm=False)
         sv2 = statevector.StateVector((3,4), norm=False)
@@ -103,6 +172,33 @@ class StateVectorTrajectoryTestCase(unittest.TestCase):
         sv = statevector.StateVectorTrajectory(map(self.sv, t))
         self.assertEqual(sv.shape, (20,16))
 
+    def test_nocopy(self):
+        t = numpy.linspace(0,5,20)
+        data = numpy.array(map(self.sv, t))
+        sv = statevector.StateVectorTrajectory(data, t, copy=False)
+        self.assert_(numpy.may_share_memory(sv, data))
+        svs = sv.statevectors
+        self.assertEqual(len(svs), 20)
+        self.assert_(isinstance(svs[-1], statevector.StateVector))
+        self.assertEqual(svs[-1].time, t[-1])
+        self.assert_(numpy.may_share_memory(svs[3], data))
+        self.assert_((svs[3]==data[3]).all())
+        self.assertEqual([s.time for s in svs[2:8:3]], list(t[2:8:3]))
+        self.assertEqual(len(list(svs)), 20)
+        self.assertRaises(IndexError, lambda:svs[20])
+        self.assert_(sv.statevectors[5] is sv.statevectors[-15])
+        p = sv.statevectors[5].marginal()
+        self.assertEqual(len(sv._cache), 1)
+        self.assert_((5, "marginal", (0,)) in sv._cache)
+        sv.marginals()
+        sv *= 2
+        self.assertEqual(len(sv._cache), 0)
+        self.assert_((abs(sv.statevectors[5].marginal() - 4*p) < 1e-12)
+                     .all())
+        sv.marginals()
+        sv.statevectors[5] /= 2
+        self.assertEqual(len(sv._cache), 0)
+
     def test_diagexpvalue(self):
         t = numpy.linspace(0,5,20)
         sv = statevector.StateVectorTrajectory(map(self.sv, t))
@@ -115,6 +211,60 @@ class StateVectorTrajectoryTestCase(unittest.TestCase):
         self.assert_(isinstance(ev, expvalues.ExpectationValueCollection))
         self.assertEqual(ev.shape, (2,20))
 
+    def test_batchedexpvalue(self):
+        t = numpy.linspace(0,5,7)
+        sv = statevector.StateVectorTrajectory(
+                [self.sv(x, 6)^self.sv(2*x, 5)^self.sv(x, 4) for x in t])
+        X = numpy.diag(numpy.arange(5.)) + numpy.diag(numpy.ones(4), 1)*1j
+        Y = numpy.multiply.outer(numpy.arange(24.).reshape(6,4),
+                                 numpy.ones((6,4))).transpose(0,2,1,3)
+        for op, indices in ((X, 1), (Y, (0,2))):
+            ev = sv.expvalue(op, indices, chunksize=3)
+            for i, s in enumerate(sv.statevectors):
+                ref = statevector._outer_expvalue(s, op, indices)
+                self.assert_(abs(ev[i] - ref) < 1e-12)
+        D = numpy.arange(20.).reshape(5,4)
+        ev = sv.diagexpvalue((D, D**2), (2,1), multi=True, chunksize=2)
+        for i, s in enumerate(sv.statevectors):
+            ref = statevector._outer_diagexpvalue(s, D, (1,2))
+            self.assert_(abs(ev[0,i] - ref) < 1e-12)
+            ref = statevector._outer_diagexpvalue(s, D**2, (1,2))
+            self.assert_(abs(ev[1,i] - ref) < 1e-12)
+
+    def test_reductioncache(self):
+        t = numpy.linspace(0,5,7)
+        sv = statevector.StateVectorTrajectory(
+                [self.sv(x, 6)^self.sv(2*x, 5)^self.sv(x, 4) for x in t])
+        p = sv.marginals((0,2), chunksize=3)
+        self.assertEqual(p.shape, (7,6,4))
+        self.assert_((sv.marginals((2,0)) == p).all())
+        self.assert_(sv.marginals((2,0)) is not p)
+        D = numpy.arange(24.).reshape(6,4)
+        ev = sv.diagexpvalue(D, (0,2))
+        rho = sv.reducesquare(1, chunksize=2)
+        self.assertEqual(rho.shape, (7,6,4,6,4))
+        X = numpy.multiply.outer(D, D + 1j).transpose(0,2,1,3)
+        evs = sv.expvalue((X, X.conjugate()), (0,2), multi=True)
+        for i, s in enumerate(sv.statevectors):
+            self.assert_(abs(ev[i] -
+                         statevector._outer_diagexpvalue(s, D, (0,2))) < 1e-12)
+            self.assert_((abs(rho[i] - s.reducesquare(1)) < 1e-12).all())
+            ref = statevector._outer_expvalue(s, X, (0,2))
+            self.assert_(abs(evs[0,i] - ref) < 1e-12)
+        sv.clear_cache()
+        self.assertEqual(len(sv._cache), 0)
+        maxbytes = statevector.REDUCTION_CACHEBYTES
+        statevector.REDUCTION_CACHEBYTES = 3*24*24*8
+        try:
+            sv = statevector.StateVectorTrajectory(
+                    [self.sv(x, 6)^self.sv(2*x, 4) for x in t])
+            for s in sv.statevectors:
+                s.reducesquare(())
+            self.assertEqual(len(sv._cache), 3)
+            self.assert_(sv._cache.nbytes <= statevector.REDUCTION_CACHEBYTES)
+        finally:
+            statevector.REDUCTION_CACHEBYTES = maxbytes
+
 
 def suite():
     load = unittest.defaultTestLoader.loadTestsFromTestCase
@@ -26,3 +26,59 @@ class OrderedDict(DictMixin):
         copyDict._keys = self._keys[:]
         return copyDict
 
+
+class LRUCache:
+    """
+    A dictionary holding only the most recently used entries.
+
+    *Arguments*
+        * *maxsize* (optional)
+            Maximal number of entries. If it is exceeded the least recently
+            used entry is removed. (Default is None which means no limit)
+
+        * *maxbytes* (optional)
+            Maximal sum of the ``nbytes`` of all entries. If it is exceeded
+            the least recently used entries are removed. Values which alone
+            are larger are not stored at all. (Default is None which means
+            no limit)
+    """
+    def __init__(self, maxsize=None, maxbytes=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self._keys = []
+        self._data = {}
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def __getitem__(self, key):
+        value = self._data[key]
+        self._keys.remove(key)
+        self._keys.append(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key in self._data:
+            del self[key]
+        nbytes = getattr(value, "nbytes", 0)
+        if self.maxbytes is not None and nbytes > self.maxbytes:
+            return
+        self._keys.append(key)
+        self._data[key] = value
+        self.nbytes += nbytes
+        while (self.maxsize is not None and len(self._keys) > self.maxsize) \
+                or (self.maxbytes is not None and self.nbytes > self.maxbytes):
+            del self[self._keys[0]]
+
+    def __delitem__(self, key):
+        self.nbytes -= getattr(self._data.pop(key), "nbytes", 0)
+        self._keys.remove(key)
+
+    def clear(self):
+        self.nbytes = 0
+        self._keys = []
+        self._data = {}
@@ -12,10 +12,14 @@ class test(Command):
     initialize_options = lambda s:None
     finalize_options = lambda s:None
     def run(self):
-        from pycppqed import test_initialconditions, test_io, test_statevector
+        from pycppqed import test_initialconditions, test_io, test_statevector,\
+                             test_ensemble, test_operators, test_quantumsystem
         testsuits = {
+            "ensemble": test_ensemble.suite(),
+            "operators": test_operators.suite(),
             "initialconditions": test_initialconditions.suite(),
             "io": test_io.suite(),
+            "quantumsystem": test_quantumsystem.suite(),
             "statevector": test_statevector.suite(),
             }
         suite = unittest.TestSuite(testsuits.values())